@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# python3 batch.py manifest.json -j 4
+#
+# The manifest lists the datasets and the figures to make of each of them:
+# {
+#   "output": "figures",
+#   "figures": ["square", "turnout", "history", "historytraj", "bubbles"],
+#   "options": {"square": {"binwidth": 0.1, "weights": "ones", "noise": true}},
+#   "datasets": [
+#     "https://github.com/schitaytesami/lab/releases/download/data-v2/RU_2018-03-18_president.tsv.gz",
+#     {"data": "2018.tsv.gz", "name": "RU_2018", "figures": ["history", "historytraj"]}
+#   ]
+# }
+
+import collections
+import concurrent.futures
+import json
+import os
+import tempfile
+import time
+
+import election_data
+import fetch
+import spans
+
+import bubbles
+import history
+import historytraj
+import regional
+import square
+import turnout
+
+FIGURES = {
+	# kind: (module, figsize, per region)
+	'square':      (square,      (9, 9),  False),
+	'turnout':     (turnout,     (6, 2),  False),
+	'history':     (history,     (12, 4), False),
+	'historytraj': (historytraj, (12, 8), True),
+	'bubbles':     (bubbles,     (12, 8), True),
+}
+
+def datasets(manifest):
+	for entry in manifest['datasets']:
+		entry = dict(data=entry) if isinstance(entry, str) else entry
+		name = entry.get('name', os.path.basename(entry['data']).split('.')[0])
+		yield name, entry['data'], entry.get('figures', manifest.get('figures', list(FIGURES)))
+
+def histogram_options(options, kind):
+	o = options.get(kind, {})
+	return o.get('binwidth', 0.25), o.get('weights', 'voters'), o.get('minsize', 0), o.get('noise', False)
+
+def prepare(name, data, figures, options, output, tmp, stages):
+	# everything up to rendering for one dataset, each stage timed; returns the figures to render as regional.savefig_shared or regional.savefig tasks
+	tic = time.perf_counter()
+	path = fetch.fetch(data) if '//' in data and fetch.MIRROR_DIR else data
+	stages[name]['download'] += time.perf_counter() - tic
+
+	tic = time.perf_counter()
+	D = election_data.load(path)
+	stages[name]['parse'] += time.perf_counter() - tic
+
+	# the precincts square, turnout and history bin, filtered once here: the Index keeps the rows of this filter
+	# (in the order of the file, which the noise is drawn in, as in square.py and turnout.py) and the masks it is
+	# made of, so the filter calls of square.histograms and history.histogram below reuse them
+	tic = time.perf_counter()
+	I = election_data.Index(D)
+	election_data.filter(I, ballots_valid_invalid_min=1, voters_voted_le_voters_registered=True, foreign=False)
+	R = election_data.regions(I)
+	stages[name]['filter'] += time.perf_counter() - tic
+
+	# square and turnout share one square.histograms call, so their common configurations are binned once
+	tic = time.perf_counter()
+	configs = [histogram_options(options, kind) for kind in ['square', 'turnout'] if kind in figures]
+	H = dict(zip(configs, square.histograms(I, election_data.RU_LEADER, configs))) if configs else {}
+	if 'history' in figures:
+		h = options.get('history', {})
+		hist = history.histogram(I, binwidth=h.get('binwidth', 0.25), minsize=h.get('minsize', 0))
+	stages[name]['histogram'] += time.perf_counter() - tic
+
+	os.makedirs(os.path.join(output, name), exist_ok=True)
+	tasks = []
+	for kind in figures:
+		module, figsize, perregion = FIGURES[kind]
+		if kind in ['square', 'turnout']:
+			config = histogram_options(options, kind)
+			tasks.append((kind, regional.savefig, (module.draw, H[config], dict(title=name, binwidth=config[0]), os.path.join(output, name, kind + '.png'), figsize)))
+		elif kind == 'history':
+			tasks.append((kind, regional.savefig, (module.draw, hist, dict(title=name), os.path.join(output, name, kind + '.png'), figsize)))
+		elif perregion:
+			if not any(t[1] is regional.savefig_shared for t in tasks):
+				election_data.save(os.path.join(tmp, name + '.npy'), I.D)
+			os.makedirs(os.path.join(output, name, kind), exist_ok=True)
+			for region_code in R:
+				s = I.slice(region_code)
+				tasks.append((kind, regional.savefig_shared, (module.plot, os.path.join(tmp, name + '.npy'), s.start, s.stop, R[region_code], os.path.join(output, name, kind, region_code + '.png'), figsize)))
+	return tasks
+
+def run(manifest, jobs=1, dpi=None):
+	output = manifest.get('output', '.')
+	options = manifest.get('options', {})
+	stages = collections.defaultdict(lambda: dict.fromkeys(['download', 'parse', 'filter', 'histogram', 'render'], 0.0))
+	counts = collections.Counter()
+	start = time.perf_counter()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		if jobs == 1:
+			regional.attach()
+			for name, data, figures in datasets(manifest):
+				for kind, f, args in prepare(name, data, figures, options, output, tmp, stages):
+					stages[name]['render'] += f(*args, dpi)
+					counts[name, kind] += 1
+		else:
+			# rendering of one dataset overlaps the download and parsing of the next
+			with concurrent.futures.ProcessPoolExecutor(jobs, initializer=regional.attach) as pool:
+				futures = {}
+				for name, data, figures in datasets(manifest):
+					for kind, f, args in prepare(name, data, figures, options, output, tmp, stages):
+						futures[pool.submit(f, *args, dpi)] = name, kind
+				for future in concurrent.futures.as_completed(futures):
+					name, kind = futures[future]
+					stages[name]['render'] += future.result()
+					counts[name, kind] += 1
+
+	return stages, counts, time.perf_counter() - start
+
+def report(stages, counts, wall):
+	names = ['download', 'parse', 'filter', 'histogram', 'render']
+	print('dataset', *names, 'figures', sep='\t')
+	for name, t in stages.items():
+		print(name, *(f'{t[k]:.2f}s' for k in names), ', '.join(f'{kind} {n}' for (dataset, kind), n in counts.items() if dataset == name), sep='\t')
+	print('total', *(f'{sum(t[k] for t in stages.values()):.2f}s' for k in names), sum(counts.values()), sep='\t')
+	print(f'wall\t{wall:.2f}s (render is summed over workers)')
+
+if __name__ == '__main__':
+	import argparse
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('manifest', metavar='MANIFEST', help='JSON file listing the datasets and figures')
+	parser.add_argument('--dpi', default=None, type=int, help='Resolution of the output images')
+	parser.add_argument('-j', '--jobs', default=1, type=int, help='Number of processes rendering figures in parallel')
+	parser.add_argument('--profile', metavar='FILE', help='Write a Chrome trace of the stages to FILE (or set ELECTION_DATA_PROFILE)')
+	args = parser.parse_args()
+	spans.enable(args.profile)
+
+	report(*run(json.load(open(args.manifest)), jobs=args.jobs, dpi=args.dpi))
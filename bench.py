@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+
+import collections
+import csv
+import functools
+import gzip
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import bubbles
+import cube
+import election_data
+import history
+import historytraj
+import integers
+import mcd
+import ru_election_data
+import square
+import stream
+
+def load_rows(fileorurl, max_string_size = 64):
+	# the per-row loader election_data.load used to be, kept as a reference
+	if isinstance(fileorurl, str):
+		file = open(fileorurl, 'rb')
+		fileorurl = gzip.open(file, 'rt') if fileorurl.endswith('.gz') else io.TextIOWrapper(file)
+
+	rd = csv.reader(fileorurl, delimiter = '\t', lineterminator='\n')
+	it = iter(rd)
+	fieldnames = next(it)
+	first = next(it)
+	dtype = [(name, '<i4' if value.lstrip('-').isdigit() else '<f8' if value.replace('.', '', 1).isdigit() or value == 'nan' else f'<U{max_string_size}') for name, value in zip(fieldnames, first)]
+	col2idx = {n : i for i, (n, t) in enumerate(dtype)}
+	dtype += [(n, t) for n, t in [('ballots_valid_invalid', '<i4'), ('turnout', '<f4')] if n not in fieldnames]
+	T = np.empty((2048,), dtype=dtype)
+	def append(row, i):
+		if i >= len(T):
+			T.resize(2 * len(T))
+		t = tuple(int(v) if dtype[j][1][1] == 'i' else float(v) if dtype[j][1][1] == 'f' else v for j, v in enumerate(row))
+		ballots_valid_invalid = t[col2idx['ballots_valid']] + t[col2idx['ballots_invalid']]
+		turnout = (t[col2idx['voters_voted_at_station']] + t[col2idx['voters_voted_early']] + t[col2idx['voters_voted_outside_station']]) / np.float64(t[col2idx['voters_registered']])
+		T[i] = (t + (ballots_valid_invalid, turnout))[:len(dtype)]
+
+	append(first, 0)
+	i = 0
+	for i, row in enumerate(it, start=1):
+		append(row, i)
+	T.resize(i + 1)
+	return election_data.promote_candidates_to_columns(T.view(np.recarray))
+
+def histogram2d(D, leader_names, *, binwidth, weights='voters', minsize=0, noise=False, seed=1):
+	# square.histogram as it was before square.histograms, kept as a reference
+	rnd = np.random.RandomState(seed)
+	edges = np.arange(-binwidth/2, 100 + binwidth/2, binwidth)
+	D = election_data.filter(D, ballots_valid_invalid_min=1, voters_registered_min=minsize, voters_voted_le_voters_registered=True, foreign=False)
+	leader = election_data.find_leader_score(D, leader_names)
+	wval = dict(voters=D.voters_registered, given=D.voters_voted, leader=leader, ones=np.ones(D.voters_registered.shape))[weights]
+	noise1 = np.zeros(len(D)) if not noise else rnd.rand(len(D)) - .5
+	noise2 = np.zeros(len(D)) if not noise else rnd.rand(len(D)) - .5
+	return np.histogram2d(100 * (D.voters_voted + noise1) / D.voters_registered, 100 * (leader + noise2) / D.ballots_valid_invalid, bins=edges, weights=wval)[0]
+
+def timeit(f, *args, repeat = 3, **kwargs):
+	best = float('inf')
+	for _ in range(repeat):
+		tic = time.perf_counter()
+		res = f(*args, **kwargs)
+		best = min(best, time.perf_counter() - tic)
+	return best, res
+
+def same(A, B):
+	return A.dtype.names == B.dtype.names and len(A) == len(B) and all(np.array_equal(A[n], B[n], equal_nan = A.dtype[n].kind == 'f') for n in A.dtype.names)
+
+def bench_load(args):
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		t0, D0 = timeit(load_rows, args.data, repeat = args.repeat)
+	t1, D1 = timeit(election_data.load, args.data, repeat = args.repeat, cache = False)
+	print(f'load\t{len(D1)} rows\trows {t0:.3f}s\tcolumns {t1:.3f}s\t{t0 / t1:.1f}x\tsame {same(D0, D1)}')
+
+def bench_cache(args):
+	with tempfile.TemporaryDirectory() as election_data.CACHE_DIR:
+		t0, D0 = timeit(election_data.load, args.data, repeat = 1)
+		t1, D1 = timeit(election_data.load, args.data, repeat = args.repeat)
+	print(f'cache\t{len(D1)} rows\tcold {t0:.3f}s\twarm {t1:.4f}s\t{t0 / t1:.0f}x\tsame {same(D0, D1)}')
+
+def bench_memory(args):
+	# memory held by the loaded dataset, with every string a <U64 cell and with encoded string columns
+	tracemalloc.start()
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		D0 = load_rows(args.data)
+	m0 = tracemalloc.get_traced_memory()[0]
+	del D0
+	base = tracemalloc.get_traced_memory()[0]
+	D1 = election_data.load(args.data, cache = False)
+	m1 = tracemalloc.get_traced_memory()[0] - base
+	tracemalloc.stop()
+	print(f'memory\t{len(D1)} rows\t<U64 {m0 >> 20} MB\tencoded {m1 >> 20} MB ({D1.nbytes >> 20} MB codes and numbers, {sum(S.nbytes for S in D1.categories.values()) >> 20} MB strings)\t{m0 / m1:.1f}x')
+
+def bench_filter(args):
+	D = election_data.load(args.data)
+	R = election_data.regions(D)
+	loop = lambda D: [election_data.filter(D, region_code=r) for r in R]
+	t0, _ = timeit(loop, D, repeat = args.repeat)
+	t1, I = timeit(election_data.Index, D, repeat = args.repeat)
+	t2, _ = timeit(loop, I, repeat = args.repeat)
+	print(f'filter\t{len(R)} regions\tmasks {t0:.3f}s\tindex build {t1:.3f}s + slices {t2:.4f}s\t{t0 / (t1 + t2):.1f}x')
+
+def bench_histograms(args):
+	D = election_data.load(args.data)
+	configs = [(binwidth, weights, minsize, noise) for binwidth, _, minsize, noise in square.PAPERS.values() for weights in square.WEIGHTS]
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		t0, H0 = timeit(lambda: [histogram2d(D, election_data.RU_LEADER, binwidth=b, weights=w, minsize=m, noise=n) for b, w, m, n in configs], repeat = args.repeat)
+		t1, H1 = timeit(square.histograms, D, election_data.RU_LEADER, configs, repeat = args.repeat)
+	print(f'histograms\t{len(configs)} configurations\tper call {t0:.3f}s\tbatched {t1:.3f}s\t{t0 / t1:.1f}x\tsame {all(np.array_equal(h0, h1[2]) for h0, h1 in zip(H0, H1))}')
+
+def bench_cube(args):
+	# square histograms of every region and of the whole country at several bin widths, rescanning precincts and summing cube cells
+	D = election_data.Index(election_data.load(args.data))
+	R = election_data.regions(D)
+	queries = [(binwidth, weights, region_code) for binwidth in [0.1, 0.25, 0.5] for weights in square.WEIGHTS for region_code in [None] + list(R)[:10]]
+	t0, C = timeit(cube.Cube.build, D, election_data.RU_LEADER, repeat = args.repeat)
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		t1, H1 = timeit(lambda: [square.histograms(election_data.filter(D, region_code=r), election_data.RU_LEADER, [(b, w, 0, False)])[0][2] for b, w, r in queries], repeat = args.repeat)
+	t2, H2 = timeit(lambda: [C.histogram(b, w, regions=[r] if r else None)[2] for b, w, r in queries], repeat = args.repeat)
+	with tempfile.TemporaryDirectory() as tmp:
+		C.save(os.path.join(tmp, 'cube.npz'))
+		size = os.path.getsize(os.path.join(tmp, 'cube.npz'))
+	print(f'cube\t{len(queries)} queries\tbuild {t0:.3f}s ({len(C.region)} cells, {size >> 10} KB)\trescan {t1 / len(queries) * 1000:.1f}ms\tcube {t2 / len(queries) * 1000:.1f}ms per query\t{t1 / t2:.1f}x\tsame {all(map(np.array_equal, H1, H2))}')
+
+def bench_historytraj(args, regions = 3):
+	# historytraj figures of the largest regions and of the whole dataset, one line per precinct and as a density grid
+	import matplotlib
+	matplotlib.use('Agg')
+	import matplotlib.pyplot as plt
+
+	def render(D, density):
+		plt.figure(figsize = (12, 8))
+		historytraj.plot(D, title = '', density = density)
+		plt.savefig(io.BytesIO(), format = 'png')
+		plt.close()
+
+	D = election_data.Index(election_data.load(args.data))
+	largest = sorted(election_data.regions(D), key = lambda r: -len(election_data.filter(D, region_code = r)))[:regions]
+	for name, D_ in [(r, election_data.filter(D, region_code = r)) for r in largest] + [('all', D.D)]:
+		t0, _ = timeit(render, D_, False, repeat = args.repeat)
+		t1, _ = timeit(render, D_, True, repeat = args.repeat)
+		print(f'historytraj\t{name}\t{len(D_)} precincts\tlines {t0:.3f}s\tdensity {t1:.3f}s\t{t0 / t1:.1f}x')
+
+def bench_bubbles(args, regions = 3):
+	# bubbles figures of the largest regions and of the whole dataset ordered by territory, as PNG and as SVG,
+	# with every bubble and label drawn as a vector and with the rasterized, thinned path
+	import matplotlib
+	matplotlib.use('Agg')
+	import matplotlib.pyplot as plt
+
+	def render(D, format, **kwargs):
+		plt.figure(figsize = (12, 8))
+		bubbles.plot(D, title = '', **kwargs)
+		out = io.BytesIO()
+		plt.savefig(out, format = format, bbox_inches = 'tight')
+		plt.close()
+		return len(out.getvalue())
+
+	D = election_data.Index(election_data.load(args.data))
+	largest = sorted(election_data.regions(D), key = lambda r: -len(election_data.filter(D, region_code = r)))[:regions]
+	everything = D.D[np.argsort(D.D.territory, kind = 'stable')]
+	for name, D_ in [(r, election_data.filter(D, region_code = r)) for r in largest] + [('all', everything)]:
+		for format in ['png', 'svg']:
+			t0, s0 = timeit(render, D_, format, rasterize = None, thin_labels = False, repeat = args.repeat)
+			t1, s1 = timeit(render, D_, format, repeat = args.repeat)
+			print(f'bubbles\t{name}\t{len(D_)} precincts\t{format}\tvector {t0:.3f}s {s0 >> 10} KB\trasterized {t1:.3f}s {s1 >> 10} KB\t{t0 / t1:.1f}x')
+
+def bench_binning(args):
+	D = election_data.load(args.data)
+	for binwidth in [0.1, 0.25]:
+		edges = np.arange(-binwidth/2, 100 + binwidth/2, binwidth)
+		H = election_data.filter(D, ballots_valid_invalid_min=1, voters_voted_le_voters_registered=True, foreign=False)
+		x, y = 100 * H.voters_voted / H.voters_registered, 100 * election_data.find_leader_score(H, election_data.RU_LEADER) / H.ballots_valid_invalid
+		t0, h0 = timeit(lambda: np.histogram2d(x, y, bins=edges, weights=H.voters_registered)[0], repeat = args.repeat)
+		t1, h1 = timeit(lambda: np.bincount(square.binindex(x, edges) * (len(edges) + 1) + square.binindex(y, edges), weights=H.voters_registered, minlength=(len(edges) + 1) ** 2).reshape(len(edges) + 1, -1)[1:-1, 1:-1], repeat = args.repeat)
+		print(f'binning\t{binwidth}% 2-D\thistogram2d {t0:.3f}s\tarithmetic {t1:.3f}s\t{t0 / t1:.1f}x\tsame {np.array_equal(h0, h1)}')
+
+		names = [n for n in D.dtype.names if n.startswith('turnout_')]
+		t0, h0 = timeit(lambda: [np.histogram(100 * H[n], bins=edges, weights=H.voters_registered * H[n])[0] for n in names], repeat = args.repeat)
+		t1, h1 = timeit(lambda: [np.bincount(square.binindex(100 * H[n], edges), weights=H.voters_registered * H[n], minlength=len(edges) + 1)[1:-1] for n in names], repeat = args.repeat)
+		print(f'binning\t{binwidth}% history\thistogram {t0:.3f}s\tarithmetic {t1:.3f}s\t{t0 / t1:.1f}x\tclose {all(np.allclose(a, b) for a, b in zip(h0, h1))}')
+
+def bench_regions(args, lines = 500000):
+	# regioncode over a synthetic feed: glossary names, some with a district attached, some unknown
+	glossary = json.load(open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ru_election_data.json')))
+	rnd = random.Random(0)
+	names = [pat + suffix for pats in glossary['regions'].values() for pat in pats for suffix in ['', ', г. Энск']] + ['Неизвестный край', 'Москва и Московская область']
+	feed = [rnd.choice(names) for _ in range(lines)]
+
+	def scan(name, bad):
+		codes = [r for r, pats in glossary['regions'].items() for pat in pats if pat in name]
+		if len(codes) != 1:
+			bad['regions'].add(name)
+		return codes[0] if codes else ''
+	bad0, bad1 = collections.defaultdict(set), collections.defaultdict(set)
+	t0, codes0 = timeit(lambda: [scan(name, bad0) for name in feed], repeat = args.repeat)
+	t1, codes1 = timeit(lambda: list(map(ru_election_data.regionmatcher(glossary['regions'], bad1), feed)), repeat = args.repeat)
+	print(f'regions\t{lines} lines\tscan {t0:.3f}s\tmatcher {t1:.3f}s\t{t0 / t1:.0f}x\tsame {codes0 == codes1 and bad0 == bad1}')
+
+def bench_electoral_id(args):
+	# the ids of the dataset taken apart and put back together, electoral_id() per row against the codec
+	D = election_data.load(args.data)
+	ids = D.electoral_id
+	t0, parts0 = timeit(lambda: [election_data.electoral_id(i) for i in ids.tolist()], repeat = args.repeat)
+	t1, parts1 = timeit(election_data.ELECTORAL_ID.decode, ids, repeat = args.repeat)
+	same = all({k: c[i].item() for k, c in parts1.items() if c[i] not in (-1, '')} == p for i, p in enumerate(parts0))
+	print(f'electoral_id\tdecode {len(ids)} ids\tscalar {t0:.3f}s\tcodec {t1:.3f}s\t{t0 / t1:.0f}x\tsame {same}')
+
+	date, name = parts0[0]['date'], parts0[0]['election_name']
+	columns = [parts1[k].tolist() for k in ['region_code', 'district', 'territory', 'station']]
+	t0, ids0 = timeit(lambda: [election_data.electoral_id(region_code = r, date = date, election_name = name, district = d if d >= 0 else None, territory = t if t >= 0 else None, station = s if s >= 0 else None) for r, d, t, s in zip(*columns)], repeat = args.repeat)
+	t1, ids1 = timeit(election_data.ELECTORAL_ID.encode, parts1['region_code'], date, name, district = np.maximum(parts1['district'], 0), territory = np.maximum(parts1['territory'], 0), station = np.maximum(parts1['station'], 0), repeat = args.repeat)
+	print(f'electoral_id\tencode {len(ids)} ids\tscalar {t0:.3f}s\tcodec {t1:.3f}s\t{t0 / t1:.0f}x\tsame {ids0 == ids1.tolist()}')
+
+	# the parts the dataset does not have: missing, zero and negative numbers, spaces, several values, no region
+	cases = [
+		dict(region_code = 'RU-MOW', date = '2018-03-18', election_name = 'president', district = 5, territory = 12, station = 1234),
+		dict(region_code = 'RU-MOW', date = '2018-03-18', election_name = 'president', district = -1, territory = 0, station = -7),
+		dict(region_code = 'RU-MOW', date = '2018-03-18', election_name = 'president', district = None, territory = 3, station = None),
+		dict(region_code = None, date = '2018-03-18', election_name = 'president', district = 2, territory = None, station = 8),
+		dict(region_code = 'UA-40', date = None, election_name = 'rada', district = 'a b', territory = [1, 2], station = 'c'),
+	]
+	same = True
+	for case in cases:
+		scalar = election_data.electoral_id(**case)
+		numbers = {k: case.pop(k) for k in ['district', 'territory', 'station']}
+		columns = {k: np.empty(3, dtype = object) for k in numbers}
+		for k, c in columns.items():
+			for i in range(len(c)):
+				c[i] = numbers[k]
+		same &= election_data.ELECTORAL_ID.encode(**case, **columns).tolist() == [scalar] * 3
+		if all(isinstance(v, int) for v in numbers.values()):
+			same &= election_data.ELECTORAL_ID.encode(**case, **{k: np.full(3, v) for k, v in numbers.items()}).tolist() == [scalar] * 3
+	print(f'electoral_id\tencode {len(cases)} edge cases\tsame {same}')
+
+def bench_mcd(args):
+	# the national robust ellipse, and all the regional ones serially and with a process per CPU
+	D = election_data.Index(election_data.load(args.data))
+	_, X, _, _ = mcd.points(D, election_data.RU_LEADER)
+	t, E = timeit(mcd.fit, X, repeat = args.repeat)
+	print(f'mcd\tnational\t{len(X)} precincts\t{t:.3f}s\tcenter {E.mean[0]:.1f}% {E.mean[1]:.1f}%')
+	jobs = os.cpu_count()
+	t0, R0 = timeit(mcd.analyze, D, election_data.RU_LEADER, repeat = args.repeat)
+	t1, R1 = timeit(mcd.analyze, D, election_data.RU_LEADER, jobs = jobs, repeat = args.repeat)
+	print(f'mcd\t{len(R0)} fits\tserial {t0:.3f}s\t{jobs} jobs {t1:.3f}s\t{t0 / t1:.1f}x\tsame {all(np.array_equal(R0[r][1].cov, R1[r][1].cov) for r in R0)}')
+
+def bench_groups(args):
+	# the integer percentages report of every region, one filter call and its own reductions per region against one
+	# pass of groups.Groups; D is loaded without an Index, the way the per-region loops get it
+	D = election_data.load(args.data)
+	quantiles = [0.25, 0.5, 0.75]
+
+	def loop(D):
+		D = election_data.filter(D, ballots_valid_invalid_min=1, voters_registered_min=1, voters_voted_le_voters_registered=True, foreign=False)
+		rows = []
+		for region_code in sorted(election_data.regions(D)):
+			R = election_data.filter(D, region_code = region_code)
+			voted, registered = R.voters_voted.astype(np.int64), R.voters_registered.astype(np.int64)
+			leader, valid = election_data.find_leader_score(R, election_data.RU_LEADER).astype(np.int64), R.ballots_valid_invalid.astype(np.int64)
+			rows.append([len(R), np.sum(integers.whole(voted, registered)), np.sum(integers.expected(registered)), np.sum(integers.whole(leader, valid)), np.sum(integers.expected(valid)), *np.quantile(100 * voted / registered, quantiles)])
+		return np.array(rows)
+
+	def grouped(D):
+		labels, columns = integers.report(D, election_data.RU_LEADER, quantiles = quantiles)
+		return np.stack(list(columns.values()), axis = 1)[:-1]
+
+	t0, R0 = timeit(loop, D, repeat = args.repeat)
+	t1, R1 = timeit(grouped, D, repeat = args.repeat)
+	print(f'groups\t{len(R1)} regions\tfilter loop {t0:.3f}s\tgroups {t1:.3f}s\t{t0 / t1:.1f}x\tsame {np.allclose(R0, R1, rtol = 1e-12)}')
+
+def bench_stream(args, files = 3, blocksize = 1 << 22):
+	# the square and history histograms of several copies of the data, loaded whole one after another against
+	# streamed (serially and with a process per file), with the time and the peak of traced memory of each
+	configs, histories = [(0.25, 'voters', 0, False), (0.1, 'ones', 0, True), (0.5, 'leader', 100, True)], [(0.25, 0)]
+	paths = [args.data] * files
+
+	def whole():
+		S, H = zip(*((square.histograms(D, election_data.RU_LEADER, configs), history.histogram(D, binwidth = 0.25)) for D in map(lambda p: election_data.load(p, cache = False), paths)))
+		return [(S[0][i][0], S[0][i][1], sum(s[i][2] for s in S)) for i in range(len(configs))], functools.reduce(lambda a, b: {n: a.get(n, 0) + h for n, h in b[1].items()}, H, {})
+
+	def streamed(jobs):
+		S, H = stream.histograms(paths, election_data.RU_LEADER, configs, histories, blocksize = blocksize, jobs = jobs)
+		return [s[:3] for s in S], H[0][1]
+
+	def peak(f, *a):
+		tracemalloc.start()
+		f(*a)
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+		return peak >> 20
+
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		t0, (S0, H0) = timeit(whole, repeat = args.repeat)
+		t1, (S1, H1) = timeit(streamed, 1, repeat = args.repeat)
+		t2, (S2, H2) = timeit(streamed, files, repeat = args.repeat)
+		m0, m1 = peak(whole), peak(streamed, 1)
+	same = all(a[0] == b[0] and np.array_equal(a[2], b[2]) for a, b in zip(S0, S1)) and H0.keys() == H1.keys() and all(np.array_equal(H0[n], H1[n]) for n in H0) and all(np.array_equal(a[2], b[2]) for a, b in zip(S1, S2)) and all(np.array_equal(H1[n], H2[n]) for n in H1)
+	print(f'stream\t{files} files\twhole {t0:.3f}s {m0} MB\tstreamed {t1:.3f}s {m1} MB\t{files} jobs {t2:.3f}s\tsame {same}')
+
+def feeds(path, precincts, seed = 0):
+	# synthetic turnouts, protocols and locations feeds in the shape ru_election_data reads
+	glossary = json.load(open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ru_election_data.json')))
+	rnd = random.Random(seed)
+	fields = glossary['fields']
+	regions = list(glossary['regions'].values())
+	candidates = ['Бабурин Сергей Николаевич', 'Грудинин Павел Николаевич', 'Путин Владимир Владимирович', 'Собчак Ксения Анатольевна']
+	with gzip.open(os.path.join(path, 'turnouts.jsonl.gz'), 'wt') as ft, gzip.open(os.path.join(path, 'protocols.jsonl.gz'), 'wt') as fp, gzip.open(os.path.join(path, 'locations.jsonl.gz'), 'wt') as fl:
+		for i in range(precincts):
+			region = rnd.choice(regions[i % len(regions)])
+			loc = [region, f'{rnd.randint(1, 40)} Территориальная избирательная комиссия района', f'УИК №{i}']
+			print(json.dumps(dict(loc = loc, turnouts = {t: rnd.random() for t in glossary['turnouts'].values()}), ensure_ascii = False), file = ft)
+			registered = rnd.randint(0, 3000); voted = rnd.randint(0, registered)
+			lines = {fields['voters_registered'][0]: registered, fields['voters_voted_at_station'][0]: voted, fields['voters_voted_early'][0]: 0, fields['voters_voted_outside_station'][0]: rnd.randint(0, 50), fields['ballots_valid'][0]: voted, fields['ballots_invalid'][0]: rnd.randint(0, 9)}
+			lines.update((c, rnd.randint(0, voted // 3 + 1)) for c in candidates)
+			print(json.dumps(dict(loc = loc, data = [dict(line_name = k, line_val = str(v)) for k, v in lines.items()]), ensure_ascii = False), file = fp)
+			print(json.dumps(dict(region = region, text = f'Участковая избирательная комиссия №{i}', address = 'ул. Ленина', coords = dict(lat = '55.1', lon = '37.2'), voteaddress = 'ул. Мира', votecoords = dict(lat = '', lon = '')), ensure_ascii = False), file = fl)
+
+def ingest(path, output, *options):
+	subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ru_election_data.py'), '--date', '2018-03-18', '--name', 'president', *options] + [f'--{feed}={os.path.join(path, feed + ".jsonl.gz")}' for feed in ['turnouts', 'protocols', 'locations']] + [output], check = True, stderr = subprocess.DEVNULL)
+	return open(output, 'rb').read()
+
+def bench_ingest(args, precincts = 100000):
+	# ru_election_data over synthetic gzipped feeds, serially and with a process per CPU
+	jobs = os.cpu_count()
+	with tempfile.TemporaryDirectory() as tmp:
+		feeds(tmp, precincts)
+		t0, out0 = timeit(ingest, tmp, os.path.join(tmp, '1.tsv'), '--jobs=1', repeat = args.repeat)
+		t1, out1 = timeit(ingest, tmp, os.path.join(tmp, f'{jobs}.tsv'), f'--jobs={jobs}', repeat = args.repeat)
+	print(f'ingest\t{precincts} precincts\tserial {t0:.3f}s\t{jobs} jobs {t1:.3f}s\t{t0 / t1:.1f}x\tsame {out0 == out1}')
+
+def bench_columnar(args, precincts = 100000):
+	# the same synthetic dataset written by ru_election_data as TSV and as .npz columns, loaded back
+	with tempfile.TemporaryDirectory() as tmp:
+		feeds(tmp, precincts)
+		ingest(tmp, os.path.join(tmp, 'D.tsv'), '--npz=' + os.path.join(tmp, 'D.npz'))
+		t0, D0 = timeit(election_data.load, os.path.join(tmp, 'D.tsv'), repeat = args.repeat, cache = False)
+		t1, D1 = timeit(election_data.load, os.path.join(tmp, 'D.npz'), repeat = args.repeat, cache = False)
+		sizes = os.path.getsize(os.path.join(tmp, 'D.tsv')) >> 20, os.path.getsize(os.path.join(tmp, 'D.npz')) >> 20
+	print(f'columnar\t{len(D1)} rows\ttsv {t0:.3f}s ({sizes[0]} MB)\tnpz {t1:.3f}s ({sizes[1]} MB)\t{t0 / t1:.1f}x\tsame {same(D0, D1)}')
+
+def stages(data, repeat = 1):
+	# the pipeline every figure goes through, stage by stage, each stage a function of the previous one's result
+	import matplotlib
+	matplotlib.use('Agg')
+	import matplotlib.pyplot as plt
+
+	def parse(_):
+		with np.errstate(divide = 'ignore', invalid = 'ignore'):
+			return election_data.load(data, cache = False)
+
+	def filter(D):
+		I = election_data.Index(D)
+		for region_code in election_data.regions(I):
+			election_data.filter(I, region_code = region_code, ballots_valid_invalid_min = 1, voters_voted_le_voters_registered = True, foreign = False)
+		return I
+
+	def histogram(I):
+		return I, square.histograms(I, election_data.RU_LEADER, list(square.PAPERS.values())), history.histogram(I)
+
+	def render(args):
+		I, H, h = args
+		largest = max(election_data.regions(I), key = lambda r: I.slice(r).stop - I.slice(r).start)
+		for draw, a, figsize in [(square.draw, H[0], (9, 9)), (history.draw, h, (12, 4)), (historytraj.plot, (election_data.filter(I, region_code = largest),), (12, 8)), (bubbles.plot, (election_data.filter(I, region_code = largest),), (12, 8))]:
+			plt.figure(figsize = figsize)
+			draw(*a, title = '')
+			plt.savefig(io.BytesIO(), format = 'png')
+			plt.close()
+
+	return [('parse', parse), ('filter', filter), ('histogram', histogram), ('render', render)]
+
+def bench_suite(args):
+	# every stage timed (best of --repeat) and then run once more under tracemalloc for its peak memory;
+	# --save stores the results as JSON, --compare prints them next to stored ones
+	results, x = {}, None
+	for name, stage in stages(args.data):
+		t, y = timeit(stage, x, repeat = args.repeat)
+		tracemalloc.start()
+		stage(x)
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+		results[name], x = dict(seconds = t, peak_mb = peak / (1 << 20)), y
+		rows = len(y) if name == 'parse' else rows
+
+	previous = json.load(open(args.compare))['stages'] if args.compare else {}
+	for name, r in results.items():
+		p = previous.get(name)
+		print(f'suite\t{name}\t{rows} rows\t{r["seconds"]:.3f}s\tpeak {r["peak_mb"]:.0f} MB' + (f'\twas {p["seconds"]:.3f}s, {p["peak_mb"]:.0f} MB\t{r["seconds"] / p["seconds"]:.2f}x time' if p else ''))
+	if args.save:
+		with open(args.save, 'w') as file:
+			json.dump(dict(data = os.path.basename(args.data), rows = rows, stages = results), file, indent = 2)
+
+if __name__ == '__main__':
+	import argparse
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('data', metavar='DATA', help='Local data file to use (synthetic.py makes one)')
+	parser.add_argument('--repeat', default=3, type=int, help='Number of runs to take the best time of')
+	parser.add_argument('--save', help='File to store the suite results in')
+	parser.add_argument('--compare', help='File with stored suite results to compare against')
+	parser.add_argument('bench', nargs='*', metavar='BENCH', default=['load'], help='Benchmarks to run')
+	args = parser.parse_args()
+
+	for name in args.bench:
+		globals()['bench_' + name](args)
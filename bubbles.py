@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 
 import numpy as np
+import matplotlib
 import matplotlib.pyplot as plt
 
 import election_data
+import spans
+import regional
 
 def rlencode(inarray):  # Run-length encoding, <https://stackoverflow.com/a/32681075>
 	ia = np.asarray(inarray)
@@ -17,30 +20,49 @@ def rlencode(inarray):  # Run-length encoding, <https://stackoverflow.com/a/3268
 		p = np.cumsum(np.append(0, z))[:-1] # positions
 		return (z, p, ia[i])
 
-def plot(D, title, unit=1000):
+def thin(positions, spacing):
+	# indices of positions at least spacing apart, greedily from the left
+	keep, last = [], -np.inf
+	for i, x in enumerate(positions):
+		if x - last >= spacing:
+			keep.append(i)
+			last = x
+	return np.array(keep, dtype=int)
+
+def plot(D, title, unit=1000, leader_names=election_data.RU_LEADER, rasterize=1000, thin_labels=True):
+	# Above rasterize precincts the bubbles are one raster image inside vector output. Territory labels (and the precinct
+	# numbers under them) that would overlap are left out, the separators of all territories are still drawn.
+	leader = election_data.find_leader_score(D, leader_names)
 	tlen, tidx, terr = rlencode(D.territory)
 	tsum = np.insert(np.cumsum(tlen), 0, 0)
 	assert np.unique(terr).shape == terr.shape
 
 	plt.title(title + '\n', size=20, va='baseline')
 	plt.scatter(np.arange(len(D.voters_registered)),
-	            100 * D.leader / D.ballots_valid_invalid,
+	            100 * leader / D.ballots_valid_invalid,
 	            s=D.voters_registered / unit * 20,
-	            alpha=0.5)
+	            alpha=0.5,
+	            rasterized=rasterize is not None and len(D) > rasterize)
 
 	plt.xlabel('Precinct')
-	for x in tsum:
-		plt.axvline(x, 0, 1, color='black', alpha=0.25, linewidth=1)
 	ax1 = plt.gca()
+	ax1.vlines(tsum, 0, 1, transform=ax1.get_xaxis_transform(), color='black', alpha=0.25, linewidth=1)
 	ax1.set_xlim((0, len(D.voters_registered)))
 	ax1.set_xlabel('Precinct')
-	ax1.set_xticks(tsum[:-1])
-	ax1.set_xticklabels(D.precinct[tidx], ha='center', rotation=90)
+
+	labels = np.arange(len(tsum) - 1)
+	if thin_labels and len(labels) > 1:
+		# a label takes about its font size across, in precincts that is
+		size = matplotlib.font_manager.FontProperties(size=plt.rcParams['xtick.labelsize']).get_size_in_points()
+		width = ax1.get_window_extent().width * 72 / ax1.figure.dpi
+		labels = thin(tsum[:-1], 1.2 * size * len(D.voters_registered) / width)
+	ax1.set_xticks(tsum[:-1][labels])
+	ax1.set_xticklabels(D.precinct[tidx[labels]], ha='center', rotation=90)
 	ax2 = ax1.twiny()
 	ax2.set_xlim(ax1.get_xlim())
 	ax2.set_xlabel('Territory')
-	ax2.set_xticks(tsum[:-1])
-	ax2.set_xticklabels(terr, ha='left', rotation=60)
+	ax2.set_xticks(tsum[:-1][labels])
+	ax2.set_xticklabels(terr[labels], ha='left', rotation=60)
 	ax2.tick_params(axis='x', rotation=60,
 	                bottom=False, top=True,
 	                labelbottom=False, labeltop=True)
@@ -57,18 +79,13 @@ if __name__ == '__main__':
 	parser = argparse.ArgumentParser()
 	parser.add_argument('data', nargs='?', metavar='DATA', default='https://github.com/schitaytesami/lab/releases/download/data-v2/2018.tsv.gz', help='Data file to use')
 	parser.add_argument('--dpi', default=None, type=int, help='Resolution of the output images')
+	parser.add_argument('-j', '--jobs', default=1, type=int, help='Number of processes rendering regions in parallel')
 	parser.add_argument('-o', '--output', default='bubbles', help='Output directory')
+	parser.add_argument('--profile', metavar='FILE', help='Write a Chrome trace of the stages to FILE (or set ELECTION_DATA_PROFILE)')
 	args = parser.parse_args()
+	spans.enable(args.profile)
 
 	os.makedirs(args.output, exist_ok=True)
 
-	D = election_data.load(args.data)
-	R = election_data.regions(D)
-
-	for region_code in R:
-		print(region_code)
-		plt.figure(figsize=(12, 8))
-		plot(election_data.filter(D, region_code=region_code), title=R[region_code])
-		plt.savefig(os.path.join(args.output, region_code + '.png'),
-		            bbox_inches='tight', dpi=args.dpi)
-		plt.close()
+	D = election_data.Index(election_data.load(args.data))
+	regional.render(plot, D, args.output, dpi=args.dpi, jobs=args.jobs)
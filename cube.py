@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+import election_data
+import spans
+import square
+
+class Cube:
+	# Precincts summed by region, fine turnout bin and fine leader's result bin, for every weight of square.WEIGHTS.
+	# Only the nonempty cells are kept, so the cube is never larger than the dataset. The fine bins are step wide
+	# starting at 0%, and a square.histograms bin of width w, centered on a multiple of w, is a run of w / step of them
+	# whenever w is an even multiple of step (0.05, 0.1, 0.25, 0.5, 1 for the default step). Fine index 2i + 1 is the
+	# inside of [i, i + 1) * step and 2i is exactly i * step: without noise the ratios are integer ones, worked out
+	# exactly, and those on an edge are binned as the float square.histograms computes for them, so the results agree.
+	def __init__(self, codes, names, region, turnout, result, weights, step, **params):
+		self.codes, self.names = codes, names
+		self.region, self.turnout, self.result, self.weights = region, turnout, result, weights
+		self.step, self.params = step, params
+
+	@classmethod
+	@spans.traced('cube.build')
+	def build(cls, D, leader_names, minsize=0, noise=False, seed=1, step=0.025):
+		scale = int(round(100 / step))
+		D = election_data.filter(D, ballots_valid_invalid_min=1, voters_voted_le_voters_registered=True, foreign=False)
+		leader = election_data.find_leader_score(D, leader_names)
+		idx = D.voters_registered >= minsize
+		D, leader = D[idx], leader[idx]
+
+		# ratios that square.histograms would not bin at all (0 / 0, division by zero with noise) go far outside 0..100%
+		voted, registered, ballots = D.voters_voted.astype(np.int64), D.voters_registered.astype(np.int64), D.ballots_valid_invalid.astype(np.int64)
+		out = 2 * scale
+		with np.errstate(divide='ignore', invalid='ignore'):
+			if noise:
+				# the same draws as square.histograms, which never hit an edge
+				rnd = np.random.RandomState(seed)
+				noise1, noise2 = rnd.rand(len(D)) - .5, rnd.rand(len(D)) - .5
+				turnout = 2 * np.nan_to_num(np.floor(scale * (voted + noise1) / registered), nan=out, posinf=out, neginf=-out) + 1
+				result = 2 * np.nan_to_num(np.floor(scale * (leader + noise2) / ballots), nan=out, posinf=out, neginf=-out) + 1
+			else:
+				registered_ = np.maximum(registered, 1)
+				turnout = np.where(registered > 0, 2 * (scale * voted // registered_) + (scale * voted % registered_ != 0), 2 * out + 1)
+				result = 2 * (scale * leader.astype(np.int64) // ballots) + (scale * leader.astype(np.int64) % ballots != 0)
+		turnout, result = np.clip(turnout, -2 * out - 1, 2 * out + 1).astype(np.int64), np.clip(result, -2 * out - 1, 2 * out + 1).astype(np.int64)
+		out = 2 * out + 1
+
+		codes, region = np.unique(election_data.codes(D, 'region_code'), return_inverse=True)
+		names = dict(election_data.regions(D))
+		codes = np.asarray(D.categories['region_code'][codes] if election_data.encoded(D, 'region_code') else codes, dtype=str)
+
+		base = 2 * out + 1
+		cells, inverse = np.unique((region * base + turnout + out) * base + result + out, return_inverse=True)
+		weights = np.stack([np.bincount(inverse, weights=w, minlength=len(cells)) for w in [D.voters_registered, D.voters_voted, leader, np.ones(len(D))]], axis=1)
+		return cls(codes, np.array([names[c] for c in codes.tolist()], dtype=str),
+		           (cells // base ** 2).astype(np.min_scalar_type(len(codes))), (cells // base % base - out).astype(np.min_scalar_type(-out)), (cells % base - out).astype(np.min_scalar_type(-out)),
+		           weights, step, minsize=minsize, noise=noise, seed=seed)
+
+	def save(self, path):
+		np.savez_compressed(path, codes=self.codes, names=self.names, region=self.region, turnout=self.turnout, result=self.result, weights=self.weights, step=self.step, **self.params)
+
+	@classmethod
+	def load(cls, path):
+		with np.load(path) as Z:
+			return cls(**{k: Z[k] if Z[k].ndim else Z[k].item() for k in Z.files})
+
+	def regions(self):
+		return dict(zip(self.codes.tolist(), self.names.tolist()))
+
+	@spans.traced('cube.histogram')
+	def histogram(self, binwidth=0.25, weights='voters', regions=None):
+		# what square.histograms gives for (binwidth, weights, minsize, noise) of the cube, over the given region codes (all by default)
+		k = binwidth / self.step
+		if abs(k / 2 - round(k / 2)) > 1e-9 or k < 2:
+			raise ValueError(f'bin width {binwidth} is not an even multiple of the cube step {self.step}')
+		k = int(round(k))
+
+		# the cells are sorted by region, so a region is a slice of them
+		if regions is None:
+			cells = slice(None)
+		else:
+			which = np.flatnonzero(np.isin(self.codes, list(regions)))
+			lo, hi = np.searchsorted(self.region, which), np.searchsorted(self.region, which, side='right')
+			cells = slice(lo[0], hi[0]) if len(which) == 1 else np.concatenate([np.arange(a, b) for a, b in zip(lo, hi)] + [np.empty(0, dtype=np.intp)])
+		edges = np.arange(-binwidth/2, 100 + binwidth/2, binwidth)
+		n = len(edges) - 1
+		def coarse(f):
+			# the first coarse bin starts half a bin below 0, a ratio on a fine edge goes through the float binning of square
+			i = f.astype(np.intp) // 2
+			j = (i + k // 2) // k
+			on_edge = f % 2 == 0
+			j[on_edge] = square.binindex(i[on_edge] * 100 / round(100 / self.step), edges) - 1
+			return j
+		t, r = coarse(self.turnout[cells]), coarse(self.result[cells])
+		inside = (t >= 0) & (t < n) & (r >= 0) & (r < n)
+		h = np.bincount(t[inside] * n + r[inside], weights=self.weights[cells, list(square.WEIGHTS).index(weights)][inside], minlength=n * n).reshape(n, n)
+		return square.WEIGHTS[weights], np.arange(0, 100, binwidth), h, np.sum(h, axis=1), np.sum(h, axis=0)
+
+if __name__ == '__main__':
+	import os
+	import argparse
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('data', nargs='?', metavar='DATA', default='https://github.com/schitaytesami/lab/releases/download/data-v2/RU_2018-03-18_president.tsv.gz', help='Data file to use')
+	parser.add_argument('--min-size', default=0, type=int, help='Minimum precinct size to include')
+	parser.add_argument('--noise', action='store_true', help='Add U(-0.5,0.5) noise to the numerators (to remove division artifacts)')
+	parser.add_argument('--step', default=0.025, type=float, help='Fine bin width in percentage points')
+	parser.add_argument('-o', '--output', default='cube.npz', help='Output file')
+	parser.add_argument('--profile', metavar='FILE', help='Write a Chrome trace of the stages to FILE (or set ELECTION_DATA_PROFILE)')
+	args = parser.parse_args()
+	spans.enable(args.profile)
+
+	C = Cube.build(election_data.load(args.data), election_data.RU_LEADER, minsize=args.min_size, noise=args.noise, step=args.step)
+	C.save(args.output)
+	print(f'{len(C.region)} cells, {len(C.codes)} regions, {os.path.getsize(args.output) >> 10} KB')
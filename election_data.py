@@ -1,43 +1,277 @@
 import re
+import bisect
 import csv
+import glob
 import gzip
+import hashlib
 import io
+import os
+import tempfile
 import unicodedata
+import urllib.error
 import urllib.request
 import numpy as np
 import numpy.lib.recfunctions # http://pyopengl.sourceforge.net/pydoc/numpy.lib.recfunctions.html
 
+import fetch
+import spans
+
 RU_LEADER = ['Путин', 'Медведев']
 RU_TRANSLIT = ('АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯабвгдеёжзийклмнопрстуфхцчшщъыьэюя',
                'ABVGDEEZZIJKLMNOPRSTUFHCCSSYYYEUAabvgdeezzijklmnoprstufhccssyyyeua')
 
-def load(fileorurl, max_string_size = 64, encoding = 'utf-8', latin = False):
+# Parsed datasets are kept as .npy files here and load() returns them memory-mapped read-only, set ELECTION_DATA_CACHE= to disable
+CACHE_DIR = os.environ.get('ELECTION_DATA_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'election_data'))
+CACHE_SIZE = int(os.environ.get('ELECTION_DATA_CACHE_SIZE', 4 << 30))
+
+def digest(obj):
+	return hashlib.sha1(repr(obj).encode('utf-8')).hexdigest()[:16]
+
+def cache_source(fileorurl):
+	return fileorurl if '//' in fileorurl else os.path.abspath(fileorurl)
+
+def cache_path(fileorurl, timeout = 10, **options):
+	source = cache_source(fileorurl)
+	prefix = os.path.join(CACHE_DIR, digest(source) + '-' + digest(sorted(options.items())) + '-')
+	if '//' in source:
+		try:
+			with urllib.request.urlopen(urllib.request.Request(source, method = 'HEAD'), timeout = timeout) as r:
+				version = [r.headers.get('ETag'), r.headers.get('Last-Modified'), r.headers.get('Content-Length')]
+		except urllib.error.HTTPError:
+			raise
+		except (urllib.error.URLError, TimeoutError):
+			# offline, fall back to the most recent copy we have
+			return max(glob.glob(glob.escape(prefix) + '*.npy'), key = os.path.getmtime, default = None)
+	else:
+		st = os.stat(source)
+		version = [st.st_mtime_ns, st.st_size]
+	return prefix + digest(version) + '.npy'
+
+def strings_path(path):
+	return path[:-len('.npy')] + '.strings.npz'
+
+def save(path, D):
+	# the rows as an .npy file, the strings of encoded columns as an .npz next to it (written first)
+	if isinstance(D, Table) and D.categories:
+		with tempfile.NamedTemporaryFile(dir = os.path.dirname(path), suffix = '.tmp', delete = False) as file:
+			np.savez(file, **{f'{n}.{k}': a for n, S in D.categories.items() for k, a in [('offsets', S.offsets), ('data', S.data)]})
+		os.replace(file.name, strings_path(path))
+	with tempfile.NamedTemporaryFile(dir = os.path.dirname(path), suffix = '.tmp', delete = False) as file:
+		np.lib.format.write_array(file, np.asarray(D), version = None if all(n.isascii() for n in D.dtype.names) else (3, 0), allow_pickle = False)
+	os.replace(file.name, path)
+
+def memmap(path):
+	D = np.load(path, mmap_mode = 'r').view(Table)
+	if os.path.exists(strings_path(path)):
+		with np.load(strings_path(path)) as Z:
+			D.categories = {n: Strings(Z[n + '.offsets'], Z[n + '.data']) for n in dict.fromkeys(k.rpartition('.')[0] for k in Z.files)}
+	return D
+
+def remove(path):
+	os.remove(path)
+	if os.path.exists(strings_path(path)):
+		os.remove(strings_path(path))
+
+def cache_store(path, D):
+	os.makedirs(CACHE_DIR, exist_ok = True)
+	save(path, D)
+
+	for p in glob.glob(glob.escape(path[:path.rindex('-') + 1]) + '*.npy'):
+		if p != path:
+			remove(p)
+
+	# least recently used first, load() touches the entries it hits
+	entries = sorted(glob.glob(os.path.join(glob.escape(CACHE_DIR), '*.npy')), key = os.path.getmtime)
+	size = lambda p: os.path.getsize(p) + (os.path.getsize(strings_path(p)) if os.path.exists(strings_path(p)) else 0)
+	total = sum(map(size, entries))
+	for p in entries:
+		if total <= CACHE_SIZE:
+			break
+		if p != path:
+			total -= size(p)
+			remove(p)
+
+def uncache(fileorurl = None):
+	pattern = (digest(cache_source(fileorurl)) if fileorurl is not None else '') + '*.npy'
+	for p in glob.glob(os.path.join(glob.escape(CACHE_DIR), pattern)):
+		remove(p)
+
+def load(fileorurl, encoding = 'utf-8', latin = False, blocksize = 1 << 24, cache = True):
+	path = cache_path(fileorurl, latin = latin, strings = 'encoded') if cache and CACHE_DIR and isinstance(fileorurl, str) else None
+	if path is not None and os.path.exists(path):
+		with spans.span('load.cache', path = path):
+			os.utime(path)
+			return memmap(path)
+	elif path is not None:
+		D = load(fileorurl, encoding = encoding, latin = latin, blocksize = blocksize, cache = False)
+		with spans.span('load.cache_store', path = path):
+			cache_store(path, D)
+		# the stored copy, so that a miss gives the same read-only memory map as a hit
+		return memmap(path)
+
+	if isinstance(fileorurl, str) and fileorurl.endswith('.npz'):
+		# columnar output of ru_election_data.py (see savez), the schema comes with the file and nothing is parsed
+		path = fetch.fetch(fileorurl)
+		try:
+			with spans.span('load.npz'), np.load(path) as Z:
+				columns = {n: Z[n] for n in Z.files if '.' not in n}
+				categories = {n: Strings(Z[n + '.offsets'], Z[n + '.data']) for n in columns if n + '.offsets' in Z.files}
+		finally:
+			if '//' in fileorurl and not fetch.MIRROR_DIR:
+				os.remove(path)
+		fieldnames = list(columns)
+		dtype = [(n, c.dtype.str) for n, c in columns.items()]
+		dtype += [(n, t) for n, t in [('ballots_valid_invalid', '<i4'), ('turnout', '<f4')] if n not in fieldnames]
+		T = np.empty((len(columns[fieldnames[0]]) if fieldnames else 0,), dtype=dtype)
+		for n, c in columns.items():
+			T[n] = c
+		return derive_columns(T, fieldnames, latin = latin, categories = categories)
+
+	fieldnames, dtype, blocks = read(fileorurl, blocksize = blocksize)
+	blocks = list(blocks)
+	with spans.span('load.concatenate', rows = sum(map(len, blocks))):
+		T = np.empty((sum(map(len, blocks)),), dtype=dtype)
+		for n in fieldnames:
+			np.concatenate([B[n] for B in blocks], out = T[n])
+
+	return derive_columns(T, fieldnames, latin = latin)
+
+def read(fileorurl, blocksize = 1 << 24):
+	# The column names and types of a TSV file (guessed from its first row) and a generator of its rows, parsed a
+	# block of about blocksize bytes of lines at a time
 	if isinstance(fileorurl, str):
-		file = urllib.request.urlopen(fileorurl) if fileorurl.startswith('http') else open(fileorurl, 'rb')
+		file = fetch.open(fileorurl) if '//' in fileorurl else open(fileorurl, 'rb')
 		fileorurl = gzip.open(file, 'rt') if fileorurl.endswith('.gz') else io.TextIOWrapper(file)
 
 	#head = np.genfromtxt(io.BytesIO(b), max_rows = 2 if has_names else 1, delimiter = delimiter, names = True if has_names else None, dtype = None, encoding = encoding)
-	rd = csv.reader(fileorurl, delimiter = '\t', lineterminator='\n')
-	it = iter(rd)
-	fieldnames = next(it)
-	first = next(it)
-	dtype = [(name, '<i4' if value.lstrip('-').isdigit() else '<f8' if value.replace('.', '', 1).isdigit() or value == 'nan' else f'<U{max_string_size}') for name, value in zip(fieldnames, first)]
-	col2idx = {n : i for i, (n, t) in enumerate(dtype)}
+	head = [fileorurl.readline(), fileorurl.readline()]
+	fieldnames, first = csv.reader(head, delimiter = '\t', lineterminator='\n')
+	dtype = [(name, '<i4' if value.lstrip('-').isdigit() else '<f8' if value.replace('.', '', 1).isdigit() or value == 'nan' else 'O') for name, value in zip(fieldnames, first)]
 	dtype += [(n, t) for n, t in [('ballots_valid_invalid', '<i4'), ('turnout', '<f4')] if n not in fieldnames]
-	T = np.empty((2048,), dtype=dtype)
-	def append(row, i):
-		if i >= len(T):
-			T.resize(2 * len(T))
-		t = tuple(int(v) if dtype[j][1][1] == 'i' else float(v) if dtype[j][1][1] == 'f' else v for j, v in enumerate(row))
-		ballots_valid_invalid = t[col2idx['ballots_valid']] + t[col2idx['ballots_invalid']]
-		turnout = (t[col2idx['voters_voted_at_station']] + t[col2idx['voters_voted_early']] + t[col2idx['voters_voted_outside_station']]) / np.float64(t[col2idx['voters_registered']])
-		T[i] = (t + (ballots_valid_invalid, turnout))[:len(dtype)] 
-
-	append(first, 0)
-	for i, row in enumerate(it, start=1):
-		append(row, i)
-	T.resize(i)
-	return promote_candidates_to_columns(T.view(np.recarray), latin = latin)
+
+	# whole blocks of lines go through numpy's C tokenizer, which follows the csv module's quoting rules
+	# read is the transfer and decompression, tokenize the parsing of the lines read
+	def blocks(lines):
+		while lines:
+			with spans.span('load.tokenize', lines = len(lines)):
+				yield np.loadtxt(lines, dtype = dtype[:len(fieldnames)], delimiter = '\t', comments = None, quotechar = '"', ndmin = 1)
+			with spans.span('load.read'):
+				lines = fileorurl.readlines(blocksize)
+
+	with spans.span('load.read'):
+		lines = head[1:] + fileorurl.readlines(blocksize)
+	return fieldnames, dtype, blocks(lines)
+
+def chunks(fileorurl, latin = False, blocksize = 1 << 24):
+	# The dataset as a sequence of tables of about blocksize bytes of the TSV each, each one like load() would give
+	# for its rows alone, for going through a file in constant memory
+	if isinstance(fileorurl, str) and fileorurl.endswith('.npz'):
+		yield load(fileorurl, latin = latin, cache = False)
+		return
+	fieldnames, dtype, blocks = read(fileorurl, blocksize = blocksize)
+	for B in blocks:
+		T = np.empty((len(B),), dtype=dtype)
+		for n in fieldnames:
+			T[n] = B[n]
+		yield derive_columns(T, fieldnames, latin = latin)
+
+def savez(path, T):
+	# T as one array per column, string columns as codes plus the offsets and data of their Strings
+	D = encode(T)
+	np.savez(path, **{k: a for n in D.dtype.names for k, a in [(n, codes(D, n))] + ([(n + '.offsets', D.categories[n].offsets), (n + '.data', D.categories[n].data)] if encoded(D, n) else [])})
+
+@spans.traced('load.derive')
+def derive_columns(T, fieldnames, latin = False, categories = {}):
+	if 'ballots_valid_invalid' not in fieldnames:
+		T['ballots_valid_invalid'] = T['ballots_valid'] + T['ballots_invalid']
+	if 'turnout' not in fieldnames:
+		with np.errstate(divide = 'ignore', invalid = 'ignore'):
+			T['turnout'] = (T['voters_voted_at_station'] + T['voters_voted_early'] + T['voters_voted_outside_station']) / T['voters_registered'].astype(np.float64)
+	return promote_candidates_to_columns(encode(T, categories), latin = latin)
+
+class Strings:
+	# The distinct values of a string column, sorted, as one UTF-8 buffer and offsets into it. Indexing with
+	# an array of codes decodes each distinct code once.
+	def __init__(self, offsets, data):
+		self.offsets, self.data = offsets, data
+
+	@classmethod
+	def fromvalues(cls, values):
+		encoded = [v.encode('utf-8') for v in values]
+		return cls(np.cumsum([0] + list(map(len, encoded)), dtype = np.int64), np.frombuffer(b''.join(encoded), dtype = np.uint8))
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def __getitem__(self, k):
+		if np.ndim(k) == 0:
+			# a Python int, so that k + 1 cannot wrap around in the dtype of the codes
+			k = int(k)
+			return self.data[self.offsets[k] : self.offsets[k + 1]].tobytes().decode('utf-8')
+		distinct, inverse = np.unique(k, return_inverse = True)
+		return np.array([self[i] for i in distinct.tolist()], dtype = str)[inverse.reshape(np.shape(k))] if len(distinct) else np.empty(np.shape(k), dtype = str)
+
+	def index(self, value):
+		k = bisect.bisect_left(self, value)
+		return k if k < len(self) and self[k] == value else -1
+
+	@property
+	def nbytes(self):
+		return self.offsets.nbytes + self.data.nbytes
+
+class Table(np.recarray):
+	# A recarray whose string columns hold integer codes into the Strings of categories. D.name and D['name']
+	# decode a column, codes(D, name) gives the codes, which filter(), regions() and Index work on.
+	def __array_finalize__(self, obj):
+		super().__array_finalize__(obj)
+		self.categories = getattr(obj, 'categories', {})
+
+	def __getattribute__(self, attr):
+		categories = object.__getattribute__(self, '__dict__').get('categories')
+		if categories and attr in categories:
+			return categories[attr][np.recarray.__getattribute__(self, attr)]
+		return np.recarray.__getattribute__(self, attr)
+
+	def __getitem__(self, indx):
+		obj = np.recarray.__getitem__(self, indx)
+		return self.categories[indx][obj] if isinstance(indx, str) and indx in self.categories else obj
+
+@spans.traced('load.encode')
+def encode(T, categories = {}):
+	# every string column of T as codes of the smallest unsigned type that fits, nothing is truncated;
+	# columns that already are codes come with their Strings in categories
+	categories, columns = dict(categories), {}
+	for n in T.dtype.names:
+		if T.dtype[n].kind in 'OU':
+			# numbered in order of appearance through a dict, which is much faster than sorting the strings, then renumbered in sorted order
+			seen = {}
+			first = np.fromiter((seen.setdefault(v, len(seen)) for v in T[n].tolist()), dtype = np.int64, count = len(T))
+			distinct = sorted(seen)
+			rank = np.empty(len(seen), dtype = np.min_scalar_type(max(len(seen) - 1, 0)))
+			rank[[seen[v] for v in distinct]] = np.arange(len(seen))
+			categories[n], columns[n] = Strings.fromvalues(distinct), rank[first]
+	D = np.empty(T.shape, dtype = [(n, columns[n].dtype if n in columns else T.dtype[n]) for n in T.dtype.names])
+	for n in T.dtype.names:
+		D[n] = columns[n] if n in columns else T[n]
+	D = D.view(Table)
+	D.categories = categories
+	return D
+
+def encoded(D, name):
+	return isinstance(D, Table) and name in D.categories
+
+def codes(D, name):
+	return np.recarray.__getitem__(D, name) if encoded(D, name) else D[name]
+
+def value(D, name, i):
+	return D.categories[name][codes(D, name)[i]] if encoded(D, name) else D[name][i]
+
+def equal(D, name, value):
+	# D[name] == value without decoding the column
+	if not encoded(D, name):
+		return D[name] == value
+	k = D.categories[name].index(value)
+	return codes(D, name) == k if k >= 0 else np.zeros(len(D), dtype = bool)
 
 def latinize(s, safe = False, T = {ord(a): ord(b) for a, b in zip(*RU_TRANSLIT)}, S = dict([(' ', '_')] + [(ord(c), None) for c in ''',."'()'''])):
 	#s = unicodedata.normalize('NFD', translit(s)).encode('ascii', 'ignore').decode('ascii')
@@ -46,22 +280,29 @@ def latinize(s, safe = False, T = {ord(a): ord(b) for a, b in zip(*RU_TRANSLIT)}
 def latinize_(s, lower = False, latin = False, **kwargs):
 	return ((s.lower() if lower else s) if latin else latinize((s.lower() if lower else s), safe = True)).replace(' ', '_')
 
+@spans.traced('load.promote')
 def promote_candidates_to_columns(D, latin = False):
-	name_map = {name.replace('_name', '_ballots') : 'candidate_' + latinize_(D[name][0], latin = latin) for name in D.dtype.names if name.endswith('_name') and len(np.unique(D[name])) == 1}
+	name_map = {name.replace('_name', '_ballots') : 'candidate_' + latinize_(value(D, name, 0), latin = latin) for name in D.dtype.names if name.endswith('_name') and len(D) and (codes(D, name) == codes(D, name)[0]).all()}
 	D = np.lib.recfunctions.rename_fields(D, name_map)
 	return D
 
 def find_leader_score(D, leader_names, latin = False):
-	return [D[n.replace('_name', '_ballots')] for n in D.dtype.names if n.endswith('_name') and any(latinize_(l, lower = True, latin = latin) in latinize_(D[n][0], lower = True) for l in leader_names)][0]
+	name = [n for n in D.dtype.names if n.endswith('_name') and any(latinize_(l, lower = True, latin = latin) in latinize_(value(D, n, 0), lower = True) for l in leader_names)][0]
+	ballots = name.replace('_name', '_ballots')
+	return D[ballots] if ballots in D.dtype.names else D['candidate_' + latinize_(value(D, name, 0), latin = latin)]
 
+@spans.traced('filter')
 def filter(D, region_code=None, region_name=None, voters_registered_min=None, voters_voted_le_voters_registered=False, foreign=None, ballots_valid_invalid_min=None):
+	if isinstance(D, Index):
+		return D.filter(region_code=region_code, region_name=region_name, voters_registered_min=voters_registered_min, voters_voted_le_voters_registered=voters_voted_le_voters_registered, foreign=foreign, ballots_valid_invalid_min=ballots_valid_invalid_min)
+
 	idx = np.full(len(D), True)
 
 	if region_code:
-		idx &= D.region_code == region_code
+		idx &= equal(D, 'region_code', region_code)
 
 	if region_name:
-		idx &= D.region_name == region_name
+		idx &= equal(D, 'region_name', region_name)
 
 	if voters_registered_min is not None:
 		idx &= D.voters_registered >= voters_registered_min
@@ -78,21 +319,166 @@ def filter(D, region_code=None, region_name=None, voters_registered_min=None, vo
 	return D[idx]
 
 def regions(D):
+	if isinstance(D, Index):
+		return D.regions()
+	if encoded(D, 'region_code') and encoded(D, 'region_name'):
+		pairs = np.unique(np.stack([codes(D, 'region_code'), codes(D, 'region_name')], axis = 1).astype(np.int64), axis = 0)
+		return dict(zip(D.categories['region_code'][pairs[:, 0]].tolist(), D.categories['region_name'][pairs[:, 1]].tolist()))
 	return dict(np.unique(D[['region_code', 'region_name']], axis = 0).tolist())
 
+class Index:
+	# Precincts grouped by region once, so that per-region filter() calls return slices of D instead
+	# of rescanning it. Rows are reordered only if some region's precincts are not already contiguous; filters
+	# over all regions still return the rows in their original order (the order the noise of square.histograms
+	# is drawn in), through order, the original position of every row of self.D.
+	@spans.traced('index')
+	def __init__(self, D):
+		keys, first, inverse = np.unique(codes(D, 'region_code'), return_index = True, return_inverse = True)
+		self.original, self.order = D, None
+		if np.count_nonzero(inverse[1:] != inverse[:-1]) + 1 > len(keys):
+			self.order = np.argsort(inverse, kind = 'stable')
+			D, inverse = D[self.order], inverse[self.order]
+			first = np.searchsorted(inverse, np.arange(len(keys)))
+		self.D = D
+		self.codes = D.categories['region_code'][keys] if encoded(D, 'region_code') else keys
+		self.start = first
+		self.stop = first + np.bincount(inverse, minlength = len(keys))
+		if encoded(D, 'region_name'):
+			names = codes(D, 'region_name')
+			self.names = [D.categories['region_name'][names[lo:hi].max()] for lo, hi in zip(self.start, self.stop)]
+		else:
+			self.names = [np.unique(D.region_name[lo:hi])[-1] for lo, hi in zip(self.start, self.stop)]
+		self.masks, self.views = {}, {}
+
+	def __len__(self):
+		return len(self.D)
+
+	def regions(self):
+		return dict(zip(self.codes.tolist(), self.names))
+
+	def slice(self, region_code):
+		k = np.searchsorted(self.codes, region_code)
+		return slice(self.start[k], self.stop[k]) if k < len(self.codes) and self.codes[k] == region_code else slice(0, 0)
+
+	def mask(self, key, predicate):
+		if key not in self.masks:
+			self.masks[key] = predicate(self.D)
+		return self.masks[key]
+
+	def filter(self, region_code=None, region_name=None, voters_registered_min=None, voters_voted_le_voters_registered=False, foreign=None, ballots_valid_invalid_min=None):
+		s = self.slice(region_code) if region_code else slice(0, len(self.D))
+		if region_name and not region_code and self.names.count(region_name) == 1:
+			s = self.slice(self.codes[self.names.index(region_name)])
+		# the rows of a filter over all regions are kept, so the figures that filter the same way share them
+		everything = s.stop - s.start == len(self.D)
+		key = (region_name, voters_registered_min, voters_voted_le_voters_registered, foreign, ballots_valid_invalid_min)
+		if everything and key in self.views:
+			return self.views[key]
+		D = self.D[s]
+
+		masks = []
+		if region_name:
+			masks.append(equal(D, 'region_name', region_name))
+
+		if voters_registered_min is not None:
+			masks.append(self.mask(('voters_registered_min', voters_registered_min), lambda D: D.voters_registered >= voters_registered_min)[s])
+
+		if ballots_valid_invalid_min is not None:
+			masks.append(self.mask(('ballots_valid_invalid_min', ballots_valid_invalid_min), lambda D: D.ballots_valid_invalid >= ballots_valid_invalid_min)[s])
+
+		if voters_voted_le_voters_registered:
+			masks.append(self.mask(('voters_voted_le_voters_registered',), lambda D: D.voters_voted <= D.voters_registered)[s])
+
+		if foreign is not None:
+			masks.append(self.mask(('foreign', foreign), lambda D: D.foreign == foreign)[s])
+
+		if everything and self.order is not None:
+			mask = np.empty(len(self.D), dtype = bool)
+			mask[self.order] = np.logical_and.reduce(masks) if masks else True
+			D = self.original[mask] if masks else self.original
+		elif masks:
+			D = D[np.logical_and.reduce(masks)]
+		if everything:
+			self.views[key] = D
+		return D
+
+ELECTORAL_ID_FIELDS = dict(
+    region_code = re.compile(r'[A-Z]{2}(-[A-Z0-9]{2,3})?'),
+    date = re.compile(r'\d{4}-\d{2}-\d{2}'),
+    election_name = re.compile(r'[a-z]+'),
+    extra = re.compile(r'([A-Z]+)[=]?([a-z0-9+]+)')
+)
+ELECTORAL_ID_ALIAS = dict(district = ['D'], territory = ['T'], station = ['V'])
+
 def electoral_id(electoral_id = None, *, region_code = None, date = None, election_name = None, district = None, territory = None, station = None, **extra):
-    import re
-    fields = dict(
-        region_code = r'[A-Z]{2}(-[A-Z0-9]{2,3})?',
-        date = r'\d{4}-\d{2}-\d{2}',
-        election_name = r'[a-z]+',
-        extra = r'([A-Z]+)[=]?([a-z0-9+]+)'
-    )
-    alias = dict(district = ['D'], territory = ['T'], station = ['V'])
+    fields, alias = ELECTORAL_ID_FIELDS, ELECTORAL_ID_ALIAS
     val = lambda val, int_or_str = (lambda x: int(x) if x.isdigit() else x): list(map(int_or_str, val.split('+'))) if '+' in val else int_or_str(val)
     spacize = lambda o: str(o).replace(' ', '-')
     plusize = lambda k, val: alias.get(k, [k])[0] + '+'.join(map(spacize, val if isinstance(val, list) else [spacize(val)]))
     if electoral_id:
-        return dict((k, f) if k != 'extra' else (([k for k, a in alias.items() if m.group(1) in a] + [k])[0], val(m.group(2))) for f in electoral_id.split('_') for k, r in fields.items() for m in [re.fullmatch(r, f)] if m is not None)
+        return dict((k, f) if k != 'extra' else (([k for k, a in alias.items() if m.group(1) in a] + [k])[0], val(m.group(2))) for f in electoral_id.split('_') for k, r in fields.items() for m in [r.fullmatch(f)] if m is not None)
     else:
         return '_'.join(str(f) for f in [region_code, plusize('district', district) if district else None, plusize('territory', territory) if territory else None, plusize('station', station) if station else None, date, election_name] + [plusize(k, v) if v else None for k, v in extra.items()] if f is not None)
+
+# numpy.strings came with NumPy 2.0, numpy.char has the same functions before it
+npstrings = getattr(np, 'strings', np.char)
+
+class ElectoralIDCodec:
+	# electoral_id() over whole columns. encode() takes arrays (or single values) of the parts and builds every id
+	# with NumPy string operations; a part is left out where electoral_id() leaves it out, where it is None, 0 or ''
+	# (so the -1 of a missing number in the TSV has to be passed as 0 or None), and object arrays are formatted one
+	# value at a time like electoral_id() does, lists of values joined by '+'. decode() runs one regular expression
+	# over all the ids joined by newlines and returns the parts as columns, numbers as int64 with -1 and strings with
+	# '' where a part is missing. Ids outside the usual region_D_T_V_date_name layout (several values, extra parts)
+	# go through electoral_id() one by one, and a column they put something else than its dtype in becomes object.
+	NUMBERS = ['district', 'territory', 'station']
+
+	def __init__(self):
+		self.layout = re.compile(r'^(?:([A-Z]{2}(?:-[A-Z0-9]{2,3})?)?(?:_D([0-9]+))?(?:_T([0-9]+))?(?:_V([0-9]+))?_([0-9]{4}-[0-9]{2}-[0-9]{2})_([a-z]+)|(.*))$', re.MULTILINE)
+
+	def encode(self, region_code, date, election_name, district = None, territory = None, station = None, **extra):
+		def part(prefix, values):
+			values = np.asarray(values)
+			if values.dtype.kind == 'O':
+				present = np.array([bool(v) for v in values.ravel().tolist()], dtype = bool).reshape(values.shape)
+				text = np.array(['+'.join(str(x).replace(' ', '-') for x in (v if isinstance(v, list) else [v])) for v in values.ravel().tolist()], dtype = str).reshape(values.shape)
+			else:
+				present = values != (0 if values.dtype.kind in 'iufb' else '')
+				text = npstrings.replace(values.astype(str), ' ', '-') if values.dtype.kind == 'U' else values.astype(str)
+			return np.where(present, npstrings.add('_' + prefix, text), '')
+
+		# every part but the region code comes with the '_' before it, which is dropped again if there is no region code
+		ids = np.asarray(region_code if region_code is not None else '', dtype = str)
+		for prefix, values in [('D', district), ('T', territory), ('V', station)]:
+			if values is not None:
+				ids = npstrings.add(ids, part(prefix, values))
+		for values in [date, election_name]:
+			if values is not None:
+				ids = npstrings.add(ids, npstrings.add('_', np.asarray(values, dtype = str)))
+		for k, values in extra.items():
+			ids = npstrings.add(ids, part(k, values))
+		if region_code is None:
+			ids = np.where(npstrings.startswith(ids, '_'), npstrings.replace(ids, '_', '', 1), ids)
+		return ids.astype(f'<U{max(npstrings.str_len(ids).max(initial = 0), 1)}')
+
+	def decode(self, ids):
+		ids = np.asarray(ids, dtype = str)
+		matches = self.layout.findall('\n'.join(ids.tolist())) if len(ids) else []
+		region_code, district, territory, station, date, election_name, other = [np.array(g, dtype = str) for g in zip(*matches)] if matches else [np.empty(0, dtype = str)] * 7
+		columns = dict(region_code = region_code, date = date, election_name = election_name)
+		for k, c in zip(self.NUMBERS, [district, territory, station]):
+			columns[k] = np.where(c != '', c, '-1').astype(np.int64)
+
+		for i in np.flatnonzero(other != '').tolist():
+			for c in columns.values():
+				c[i] = -1 if c.dtype.kind == 'i' else ''
+			for k, v in electoral_id(ids[i]).items():
+				if k not in columns:
+					columns[k] = np.full(len(ids), None, dtype = object)
+				elif not (isinstance(v, int) if k in self.NUMBERS else isinstance(v, str) and len(v) <= columns[k].itemsize // 4):
+					columns[k] = columns[k].astype(object)
+				columns[k][i] = v
+		order = ['region_code', *self.NUMBERS, 'date', 'election_name']
+		return {k: columns[k] for k in order + [k for k in columns if k not in order]}
+
+ELECTORAL_ID = ElectoralIDCodec()
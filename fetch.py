@@ -0,0 +1,183 @@
+import builtins
+import hashlib
+import http.client
+import io
+import json
+import os
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import spans
+
+# Downloaded files are mirrored here and revalidated with conditional GETs, set ELECTION_DATA_MIRROR= to disable
+MIRROR_DIR = os.environ.get('ELECTION_DATA_MIRROR', os.path.join(os.path.expanduser('~'), '.cache', 'election_data', 'mirror'))
+
+def mirror_path(url, mirror = None):
+	mirror = mirror if mirror is not None else MIRROR_DIR
+	name = os.path.basename(urllib.parse.urlsplit(url).path) or 'index'
+	return os.path.join(mirror, hashlib.sha1(url.encode('utf-8')).hexdigest()[:16] + '-' + name)
+
+def readmeta(path):
+	try:
+		with builtins.open(path + '.json') as file:
+			return json.load(file)
+	except (OSError, ValueError):
+		return {}
+
+def writemeta(path, meta):
+	with builtins.open(path + '.json', 'w') as file:
+		json.dump(meta, file)
+
+def validators(response):
+	return dict(etag = response.headers.get('ETag'), last_modified = response.headers.get('Last-Modified'))
+
+def request(url, meta = {}, offset = 0, timeout = 60):
+	headers = {}
+	if offset and (meta.get('etag') or meta.get('last_modified')):
+		headers['Range'] = f'bytes={offset}-'
+		headers['If-Range'] = meta.get('etag') or meta['last_modified']
+	elif not offset and meta.get('etag'):
+		headers['If-None-Match'] = meta['etag']
+	elif not offset and meta.get('last_modified'):
+		headers['If-Modified-Since'] = meta['last_modified']
+	return urllib.request.urlopen(urllib.request.Request(url, headers = headers), timeout = timeout)
+
+def open(url, mirror = None, sha256 = None, retries = 5, timeout = 60):
+	if '//' not in url:
+		return builtins.open(url, 'rb')
+	mirror = mirror if mirror is not None else MIRROR_DIR
+	if not mirror:
+		return urllib.request.urlopen(url, timeout = timeout)
+
+	path = mirror_path(url, mirror)
+	os.makedirs(mirror, exist_ok = True)
+	meta = readmeta(path) if os.path.exists(path) and os.path.getsize(path) == readmeta(path).get('size') else {}
+	partmeta = readmeta(path + '.part') if os.path.exists(path + '.part') else {}
+	offset = os.path.getsize(path + '.part') if partmeta else 0
+
+	try:
+		# an unfinished download takes precedence, a finished one is only revalidated
+		response = request(url, partmeta if offset else meta, offset = offset, timeout = timeout)
+	except urllib.error.HTTPError as e:
+		if e.code == 304 and meta:
+			return mirrored(path, meta, sha256)
+		raise
+	except urllib.error.URLError:
+		if meta:
+			return mirrored(path, meta, sha256)
+		raise
+	if meta and response.status == 200 and meta.get('etag') and response.headers.get('ETag') == meta['etag']:
+		response.close()
+		return mirrored(path, meta, sha256)
+	return io.BufferedReader(Download(url, path, response, offset if response.status == 206 else 0, sha256 = sha256, retries = retries, timeout = timeout))
+
+def fetch(url, mirror = None, sha256 = None, **kwargs):
+	# The path of a local copy of url: its mirror, or with mirroring disabled a temporary file the caller removes
+	mirror = mirror if mirror is not None else MIRROR_DIR
+	if '//' not in url:
+		return url
+	if not mirror:
+		hash = hashlib.sha256()
+		with open(url, mirror = mirror, **kwargs) as response, tempfile.NamedTemporaryFile(suffix = '-' + os.path.basename(urllib.parse.urlsplit(url).path), delete = False) as file:
+			while block := response.read(1 << 20):
+				file.write(block)
+				hash.update(block)
+		if sha256 is not None and hash.hexdigest() != sha256:
+			os.remove(file.name)
+			raise ValueError(f'{url}: sha256 {hash.hexdigest()} does not match {sha256}')
+		return file.name
+	with open(url, mirror = mirror, sha256 = sha256, **kwargs) as file:
+		while file.read(1 << 20):
+			pass
+	return mirror_path(url, mirror)
+
+def mirrored(path, meta, sha256 = None):
+	if sha256 is not None and meta.get('sha256') != sha256:
+		raise ValueError(f'{path}: sha256 {meta.get("sha256")} does not match {sha256}')
+	return builtins.open(path, 'rb')
+
+class Download(io.RawIOBase):
+	# Serves the bytes of a download as they arrive while appending them to the mirror, so that
+	# decompression overlaps the transfer. The partial file is kept for resuming with a Range request.
+	def __init__(self, url, path, response, offset, sha256 = None, retries = 5, timeout = 60):
+		self.url, self.path, self.response, self.sha256, self.retries, self.timeout = url, path, response, sha256, retries, timeout
+		self.meta = readmeta(path + '.part') if offset else validators(response)
+		writemeta(path + '.part', self.meta)
+		length = response.headers.get('Content-Length')
+		self.size = offset + int(length) if length is not None else None
+		self.head = builtins.open(path + '.part', 'rb') if offset else None
+		self.tail = builtins.open(path + '.part', 'ab' if offset else 'wb')
+		self.hash = hashlib.sha256()
+		self.done = False
+		self.wait = 0.0
+		# the whole download, from the request to the last byte, ended by finish()
+		self.span = spans.span('download', url = url).__enter__()
+
+	def readable(self):
+		return True
+
+	def readinto(self, b):
+		if self.head is not None:
+			n = self.head.readinto(b)
+			if n:
+				self.hash.update(memoryview(b)[:n])
+				return n
+			self.head.close()
+			self.head = None
+		if self.done:
+			return 0
+
+		while True:
+			try:
+				tic = time.perf_counter()
+				n = self.response.readinto(b)
+				self.wait += time.perf_counter() - tic
+				# http.client reports a connection dropped before Content-Length as a plain EOF
+				if n or self.size is None or self.tail.tell() >= self.size:
+					break
+			except (OSError, http.client.HTTPException):
+				if not self.retries:
+					raise
+			if not self.retries:
+				raise http.client.IncompleteRead(b'', self.size - self.tail.tell())
+			self.retries -= 1
+			self.response.close()
+			self.tail.flush()
+			self.response = request(self.url, self.meta, offset = self.tail.tell(), timeout = self.timeout)
+			if self.response.status != 206:
+				raise IOError(f'{self.url}: cannot resume download at byte {self.tail.tell()}')
+		if n:
+			self.tail.write(memoryview(b)[:n])
+			self.hash.update(memoryview(b)[:n])
+			return n
+		self.finish()
+		return 0
+
+	def finish(self):
+		self.done = True
+		self.tail.close()
+		size, sha256 = os.path.getsize(self.path + '.part'), self.hash.hexdigest()
+		if (self.size is not None and size != self.size) or (self.sha256 is not None and sha256 != self.sha256):
+			os.remove(self.path + '.part')
+			os.remove(self.path + '.part.json')
+			if self.size is not None and size != self.size:
+				raise IOError(f'{self.url}: got {size} bytes instead of {self.size}')
+			# the same error as for a mirrored or temporary copy that does not match
+			raise ValueError(f'{self.url}: sha256 {sha256} does not match {self.sha256}')
+		os.replace(self.path + '.part', self.path)
+		writemeta(self.path, dict(self.meta, url = self.url, size = size, sha256 = sha256))
+		os.remove(self.path + '.part.json')
+		self.span.set(bytes = size, wait = round(self.wait, 3))
+		self.span.__exit__(None, None, None)
+		spans.counter('download', bytes = size, seconds = round(self.wait, 3))
+
+	def close(self):
+		if not self.closed:
+			self.response.close()
+			self.tail.close()
+			if self.head is not None:
+				self.head.close()
+		super().close()
@@ -0,0 +1,48 @@
+import numpy as np
+
+import election_data
+
+class Groups:
+	# The rows of D grouped by the key columns (region_code, or region_code and territory, ...), sorted once so that
+	# every group is a run of rows; a stable sort, so D already in key order (an Index) is not copied. Reductions take
+	# arrays aligned with the sorted rows, self.D, and give one value per group, for all groups in one pass.
+	def __init__(self, D, keys=('region_code',)):
+		D = D.D if isinstance(D, election_data.Index) else D
+		columns = [election_data.codes(D, k) for k in keys]
+		flat = np.ravel_multi_index([c - c.min() for c in columns], [int(c.max() - c.min()) + 1 for c in columns]) if len(D) else np.empty(0, dtype=np.intp)
+		if np.any(flat[1:] < flat[:-1]):
+			order = np.argsort(flat, kind='stable')
+			D, flat = D[order], flat[order]
+		self.D, self.keys = D, keys
+		self.start = np.flatnonzero(np.r_[True, flat[1:] != flat[:-1]]) if len(D) else np.empty(0, dtype=np.intp)
+		self.stop = np.r_[self.start[1:], len(D)]
+		self.index = np.repeat(np.arange(len(self.start)), self.stop - self.start)
+
+	def __len__(self):
+		return len(self.start)
+
+	def labels(self):
+		# the key values of every group, as tuples
+		return list(zip(*(election_data.value(self.D, k, self.start).tolist() for k in self.keys)))
+
+	def size(self):
+		return self.stop - self.start
+
+	def sum(self, values):
+		values = np.asarray(values)
+		return np.add.reduceat(values, self.start) if len(values) else np.zeros(0, dtype=values.dtype)
+
+	def count(self, mask):
+		return self.sum(np.asarray(mask, dtype=np.int64))
+
+	def mean(self, values):
+		return self.sum(values) / self.size()
+
+	def quantile(self, values, q):
+		# np.quantile (linear interpolation) of every group, shaped like q then groups
+		values = np.asarray(values, dtype=np.float64)
+		s = values[np.lexsort((values, self.index))]
+		pos = self.start + np.multiply.outer(q, self.size() - 1)
+		lo = np.floor(pos).astype(np.intp)
+		hi = np.minimum(lo + 1, self.stop - 1)
+		return s[lo] + (pos - lo) * (s[hi] - s[lo])
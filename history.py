@@ -4,25 +4,49 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 import election_data
+import spans
+import square
 
+@spans.traced('histogram')
 def histogram(D, *, binwidth=0.25, minsize=0, seed=1):
-	rnd = np.random.RandomState(seed)
-	edges = np.arange(-binwidth/2, 100 + binwidth/2, binwidth)
-	centers = np.arange(0, 100, binwidth)
+	H = Histogram(binwidth=binwidth, minsize=minsize)
+	H.add(D)
+	return H.result()
 
-	D = election_data.filter(D, ballots_valid_invalid_min=1, voters_registered_min=minsize, voters_voted_le_voters_registered=True, foreign=False)
+class Histogram:
+	# histogram() over a dataset that comes in chunks (see stream.py). The weights are fractional, so every chunk is
+	# added into the running sums with np.add.at, which adds in row order exactly as np.bincount over all the rows does.
+	def __init__(self, binwidth=0.25, minsize=0):
+		self.binwidth, self.minsize = binwidth, minsize
+		self.edges = np.arange(-binwidth/2, 100 + binwidth/2, binwidth)
+		self.centers = np.arange(0, 100, binwidth)
+		self.hs = {}
 
-	hs, ls = {}, {}
-	for name in D.dtype.names:
-		if not name.startswith('turnout_'): continue
-		n = name[len('turnout_'):].replace('h', ':') 
-		h = np.histogram(100 * D[name], bins=edges, weights=D.voters_registered * D[name])[0]
-		hs[n] = h
-		ls[n] = centers[np.argmax(h)], np.max(h)
-	return centers, hs, ls
+	def add(self, D):
+		D = election_data.filter(D, ballots_valid_invalid_min=1, voters_registered_min=self.minsize, voters_voted_le_voters_registered=True, foreign=False)
+		for name in D.dtype.names:
+			if not name.startswith('turnout_'): continue
+			n = name[len('turnout_'):].replace('h', ':')
+			if n not in self.hs:
+				self.hs[n] = np.bincount(square.binindex(100 * D[name], self.edges), weights=D.voters_registered * D[name], minlength=len(self.edges) + 1)
+			else:
+				np.add.at(self.hs[n], square.binindex(100 * D[name], self.edges), D.voters_registered * D[name])
+
+	def merge(self, other):
+		for n, h in other.hs.items():
+			if n in self.hs:
+				self.hs[n] += h
+			else:
+				self.hs[n] = h.copy()
+
+	def result(self):
+		hs = {n: h[1:-1] for n, h in self.hs.items()}
+		return self.centers, hs, {n: (self.centers[np.argmax(h)], np.max(h)) for n, h in hs.items()}
 
 def plot(D, title, **kwargs):
-	centers, hs, ls = histogram(D, **kwargs)
+	draw(*histogram(D, **kwargs), title=title)
+
+def draw(centers, hs, ls, title):
 	binwidth = centers[1] - centers[0]
 
 	plt.title(title + '\n')
@@ -47,11 +71,14 @@ if __name__ == '__main__':
 	parser.add_argument('--min-size', default=0, type=int, help='Minimum precinct size to include')
 	parser.add_argument('--dpi', default=None, type=int, help='Resolution of the output image')
 	parser.add_argument('-o', '--output', default='history.png', help='Output file')
+	parser.add_argument('--profile', metavar='FILE', help='Write a Chrome trace of the stages to FILE (or set ELECTION_DATA_PROFILE)')
 	args = parser.parse_args()
+	spans.enable(args.profile)
 
 	D = election_data.load(args.data)
 
 	plt.figure(figsize=(12, 4))
 	plot(D, title=os.path.basename(args.data), binwidth=args.bin_width, minsize=args.min_size)
-	plt.savefig(args.output, bbox_inches='tight', dpi=args.dpi)
+	with spans.span('savefig'):
+		plt.savefig(args.output, bbox_inches='tight', dpi=args.dpi)
 	plt.close()
@@ -5,24 +5,56 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 import election_data
+import spans
+import regional
 
-def plot(D, title, hours_begin = 8.00, hours_end = 20.00, linewidth = 0.02):
+def rasterize(time, y, weights, xlim, ylim, shape, block=1 << 22):
+	# The polylines through (time, y[i]) summed into a shape[0] x shape[1] grid over xlim x ylim: every polyline is
+	# sampled at the center of every grid column, a few columns at a time so that no more than block points are live.
+	nx, ny = shape
+	xs = xlim[0] + (np.arange(nx) + 0.5) * (xlim[1] - xlim[0]) / nx
+	grid = np.zeros(nx * ny)
+	for a in range(len(time) - 1):
+		# two turnouts reported at the same hour (the last one at hours_end, say) make a segment with no column
+		if time[a + 1] <= time[a]:
+			continue
+		cols = np.flatnonzero((xs >= time[a]) & (xs < time[a + 1]))
+		for lo in range(0, len(cols), max(1, block // max(len(y), 1))):
+			c = cols[lo : lo + max(1, block // max(len(y), 1))]
+			f = (xs[c] - time[a]) / (time[a + 1] - time[a])
+			with np.errstate(invalid='ignore'):
+				row = np.floor(((y[:, a, None] + (y[:, a + 1] - y[:, a])[:, None] * f) - ylim[0]) * (ny / (ylim[1] - ylim[0])))
+				ok = (row >= 0) & (row < ny)
+			grid += np.bincount((c * ny + row)[ok].astype(np.intp), weights=np.broadcast_to(weights[:, None], row.shape)[ok] if weights is not None else None, minlength=nx * ny)
+	return grid.reshape(nx, ny)
+
+def plot(D, title, hours_begin = 8.00, hours_end = 20.00, linewidth = 0.02, density = None, threshold = 5000, weights = None, shape = (560, 420)):
+	# density=None draws a density grid instead of one line per precinct above threshold precincts,
+	# weights='voters' weighs the density by voters registered
+	density = len(D) > threshold if density is None else density
 	time = [hours_begin] + [float(n.replace('turnout_', '').replace('h', '.')) for n in D.dtype.names if 'turnout_' in n] + [hours_end]
 	turnout = np.vstack([D[n] for n in D.dtype.names if 'turnout_' in n] + [D.turnout]).T
 	turnout = np.hstack([np.zeros_like(turnout[:, :1]), turnout])
+	xlim, ylim = (hours_begin - 1, hours_end + 1), (0, 100 + 5)
 	plt.suptitle(title)
 	for subplot, diff, xlabel, ylabel  in [(211, False, '', 'Turnout %'), (212, True, 'Time', 'Turnout increase %')]:
 		plt.subplot(subplot)
 		plt.xlabel(xlabel)
 		plt.ylabel(ylabel)
-		plt.gca().add_collection(matplotlib.collections.LineCollection(np.dstack([np.broadcast_to(time, turnout.shape), (np.hstack([turnout[:, :1], np.diff(turnout)]) if diff else turnout) * 100]), linewidth = linewidth))
-		plt.xlim([hours_begin - 1, hours_end + 1])
-		plt.ylim([0, 100 + 5])
+		y = (np.hstack([turnout[:, :1], np.diff(turnout)]) if diff else turnout) * 100
+		if density:
+			grid = rasterize(time, y, D.voters_registered.astype(float) if weights == 'voters' else None, xlim, ylim, shape)
+			plt.imshow(np.ma.masked_equal(grid.T, 0), origin='lower', extent=[*xlim, *ylim], aspect='auto', interpolation='none', cmap='Blues', norm=matplotlib.colors.LogNorm())
+		else:
+			plt.gca().add_collection(matplotlib.collections.LineCollection(np.dstack([np.broadcast_to(time, turnout.shape), y]), linewidth = linewidth))
+		plt.xlim(xlim)
+		plt.ylim(ylim)
 		plt.vlines(time[1:],*plt.ylim(), linewidth=.5, color='black')
 		plt.xticks(time, map('{:.0f}:00'.format, time))
 
 if __name__ == '__main__':
 	import os
+	import functools
 	import argparse
 	import matplotlib
 	matplotlib.use('Agg')
@@ -30,18 +62,15 @@ if __name__ == '__main__':
 	parser = argparse.ArgumentParser()
 	parser.add_argument('data', nargs='?', metavar='DATA', default='https://github.com/schitaytesami/lab/releases/download/data-v2/2018.tsv.gz', help='Data file to use')
 	parser.add_argument('--dpi', default=None, type=int, help='Resolution of the output image')
+	parser.add_argument('-j', '--jobs', default=1, type=int, help='Number of processes rendering regions in parallel')
+	parser.add_argument('--density-threshold', default=5000, type=int, help='Number of precincts above which a region is drawn as a density grid instead of lines')
+	parser.add_argument('--weights', default=None, choices={'voters'}, help="Weigh the density grid by 'voters' registered")
 	parser.add_argument('-o', '--output', default='historytraj', help='Output directory')
+	parser.add_argument('--profile', metavar='FILE', help='Write a Chrome trace of the stages to FILE (or set ELECTION_DATA_PROFILE)')
 	args = parser.parse_args()
+	spans.enable(args.profile)
 
 	os.makedirs(args.output, exist_ok=True)
 
-	D = election_data.load(args.data)
-	R = election_data.regions(D)
-
-	for region_code in R:
-		print(region_code)
-		plt.figure(figsize=(12, 8))
-		plot(election_data.filter(D, region_code=region_code), title=R[region_code])
-		plt.savefig(os.path.join(args.output, region_code + '.png'),
-		            bbox_inches='tight', dpi=args.dpi)
-		plt.close()
+	D = election_data.Index(election_data.load(args.data))
+	regional.render(functools.partial(plot, threshold=args.density_threshold, weights=args.weights), D, args.output, dpi=args.dpi, jobs=args.jobs)
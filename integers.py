@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# python3 integers.py RU_2018-03-18_president.tsv.gz --by region_code territory
+#
+# Precincts whose turnout or leader's result is a whole percentage, against how many there would be if the counts
+# had no preference for round numbers (fig. 3 of Kobak, Shpilkin & Pshenichnikov, AOAS 2016), for every region
+# (or territory) and for the whole country, with the quartiles of the turnout.
+
+import numpy as np
+
+import election_data
+import groups
+import spans
+
+def whole(numerator, denominator, percent=100):
+	# numerator / denominator is a whole percentage (a multiple of 100 / percent %), decided in integer arithmetic
+	return (percent * numerator % np.maximum(denominator, 1) == 0) & (denominator > 0)
+
+def expected(denominator, percent=100):
+	# The chance of whole(): of the denominator + 1 possible numerators, gcd(denominator, percent) + 1 give a whole
+	# percentage, so for a numerator spread evenly over its neighbourhood (as the U(-0.5, 0.5) noise of square.histograms
+	# or the binomial redraws of montecarlo.py make it) the chance is gcd(denominator, percent) / denominator.
+	return np.gcd(denominator, percent) / np.maximum(denominator, 1)
+
+def counts(voted, registered, leader, valid):
+	# Precincts whose turnout or leader's result is exactly a whole or a half percentage. The arguments can carry a
+	# leading axis of replicates (see montecarlo.py), the counts are taken over the last one.
+	return {
+		'turnout_whole': np.sum(whole(voted, registered), axis=-1),
+		'turnout_half':  np.sum(whole(voted, registered, 200) & ~whole(voted, registered), axis=-1),
+		'result_whole':  np.sum(whole(leader, valid), axis=-1),
+		'result_half':   np.sum(whole(leader, valid, 200) & ~whole(leader, valid), axis=-1),
+	}
+
+@spans.traced('integers')
+def report(D, leader_names, keys=('region_code',), minsize=0, quantiles=(0.25, 0.5, 0.75)):
+	# One row per group and a last one for all of them: the columns of the report as arrays, and the group labels
+	D = election_data.filter(D, ballots_valid_invalid_min=1, voters_registered_min=max(minsize, 1), voters_voted_le_voters_registered=True, foreign=False)
+	G = groups.Groups(D, keys)
+	D = G.D
+	voted, registered = D.voters_voted.astype(np.int64), D.voters_registered.astype(np.int64)
+	leader, valid = election_data.find_leader_score(D, leader_names).astype(np.int64), D.ballots_valid_invalid.astype(np.int64)
+
+	columns = dict(
+		precincts=G.size(),
+		turnout_whole=G.count(whole(voted, registered)),
+		turnout_expected=G.sum(expected(registered)),
+		result_whole=G.count(whole(leader, valid)),
+		result_expected=G.sum(expected(valid)),
+	)
+	columns.update((f'turnout_q{int(100 * q)}', t) for q, t in zip(quantiles, G.quantile(100 * voted / registered, quantiles)))
+	total = dict(
+		precincts=len(D),
+		turnout_whole=np.sum(columns['turnout_whole']), turnout_expected=np.sum(columns['turnout_expected']),
+		result_whole=np.sum(columns['result_whole']), result_expected=np.sum(columns['result_expected']),
+	)
+	total.update((f'turnout_q{int(100 * q)}', t) for q, t in zip(quantiles, np.quantile(100 * voted / registered, quantiles) if len(D) else [np.nan] * len(quantiles)))
+	return G.labels() + [('all',) * len(keys)], {k: np.append(c, total[k]) for k, c in columns.items()}
+
+if __name__ == '__main__':
+	import argparse
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('data', nargs='?', metavar='DATA', default='https://github.com/schitaytesami/lab/releases/download/data-v2/RU_2018-03-18_president.tsv.gz', help='Data file to use')
+	parser.add_argument('--by', nargs='+', default=['region_code'], help='Columns to group the precincts by')
+	parser.add_argument('--min-size', default=0, type=int, help='Minimum precinct size to include')
+	parser.add_argument('--profile', metavar='FILE', help='Write a Chrome trace of the stages to FILE (or set ELECTION_DATA_PROFILE)')
+	args = parser.parse_args()
+	spans.enable(args.profile)
+
+	labels, columns = report(election_data.load(args.data), election_data.RU_LEADER, keys=args.by, minsize=args.min_size)
+	# the excess as a number of standard deviations of a Poisson count with the expected mean
+	print(*args.by, *columns, 'turnout_excess', 'result_excess', sep='\t')
+	for i, label in enumerate(labels):
+		c = {k: v[i] for k, v in columns.items()}
+		print(*label, *(f'{v:.1f}' if isinstance(v, np.floating) else v for v in c.values()),
+		      *(f'{(c[k + "_whole"] - c[k + "_expected"]) / np.sqrt(max(c[k + "_expected"], 1e-9)):+.1f}' for k in ['turnout', 'result']), sep='\t')
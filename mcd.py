@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# python3 mcd.py RU_2018-03-18_president.tsv.gz -j 4
+#
+# A robust ellipse (Minimum Covariance Determinant) around the bulk of the precincts in the turnout × leader's
+# result plane, nationally and for every region, and the precincts outside it on the side of higher turnout and
+# higher result: how many there are and how many ballots the leader got in them beyond a typical precinct.
+
+import numpy as np
+
+import election_data
+import spans
+import workers
+
+# quantiles of the chi-squared distribution with 2 degrees of freedom, which has the closed form -2 log(1 - q)
+CUTOFF = -2 * np.log(1 - 0.975)
+MEDIAN = 2 * np.log(2)
+# the covariance of bivariate normal points within CUTOFF is the full one times P(chi2_4 <= CUTOFF) / P(chi2_2 <= CUTOFF)
+TRUNCATED = (1 - np.exp(-CUTOFF / 2) * (1 + CUTOFF / 2)) / 0.975
+
+def distances(X, mean, cov):
+	# squared Mahalanobis distances of the points X (n, 2) from k ellipses, mean (k, 2) and cov (k, 2, 2), as (k, n)
+	dx, dy = X[None, :, 0] - mean[:, None, 0], X[None, :, 1] - mean[:, None, 1]
+	a, b, c = cov[:, 0, 0, None], cov[:, 0, 1, None], cov[:, 1, 1, None]
+	return (c * dx * dx - 2 * b * dx * dy + a * dy * dy) / (a * c - b * b)
+
+def determinant(cov):
+	return cov[:, 0, 0] * cov[:, 1, 1] - cov[:, 0, 1] ** 2
+
+def estimate(X, idx, ridge):
+	# mean and covariance of the rows idx (k, h) of X for each of k subsets, kept off singular by ridge
+	S = X[idx]
+	mean = S.mean(axis=1)
+	d = S - mean[:, None]
+	cov = d.transpose(0, 2, 1) @ d / idx.shape[1]
+	cov[:, [0, 1], [0, 1]] += ridge
+	return mean, cov
+
+def csteps(X, mean, cov, h, ridge, steps):
+	# concentration steps: refit each ellipse to its h closest points, which never increases the determinant
+	for _ in range(steps):
+		mean, cov = estimate(X, np.argpartition(distances(X, mean, cov), h - 1, axis=1)[:, :h], ridge)
+	return mean, cov
+
+class Ellipse:
+	def __init__(self, mean, cov, cutoff=CUTOFF):
+		self.mean, self.cov, self.cutoff = mean, cov, cutoff
+
+	def distances(self, X):
+		return distances(X, self.mean[None], self.cov[None])[0]
+
+	def boundary(self, n=200):
+		# the points at distance cutoff, as x and y arrays
+		t = np.linspace(0, 2 * np.pi, n)
+		xy = self.mean[:, None] + np.linalg.cholesky(self.cov) @ np.stack([np.cos(t), np.sin(t)]) * np.sqrt(self.cutoff)
+		return xy[0], xy[1]
+
+def fit(X, support=None, trials=500, subsample=1500, keep=10, seed=1, maxsteps=100):
+	# FAST-MCD (Rousseeuw & Van Driessen 1999), simplified: trials random 3-point starts get two concentration steps
+	# on a subsample of at most subsample points, all at once as arrays, the keep of them with the smallest
+	# determinants get two more on all the points, and the best of those is concentrated until its determinant stops
+	# decreasing, made consistent for normal data and reweighted with the points within the 97.5% cutoff. support is
+	# the share of the points the raw ellipse covers, (n + 3) / 2n (the highest breakdown) by default.
+	n = len(X)
+	h = int(support * n) if support else (n + 3) // 2
+	rng = np.random.default_rng(seed)
+	ridge = 1e-9 * max(X.var(axis=0).sum(), 1e-12)
+
+	S = X[rng.choice(n, subsample, replace=False)] if n > subsample else X
+	mean, cov = estimate(S, np.argpartition(rng.random((trials, len(S))), 2, axis=1)[:, :3], ridge)
+	mean, cov = csteps(S, mean, cov, max(h * len(S) // n, 3), ridge, 2)
+	best = np.argsort(determinant(cov))[:keep]
+	mean, cov = csteps(X, mean[best], cov[best], h, ridge, 2)
+	k = np.argmin(determinant(cov))
+	mean, cov = mean[k, None], cov[k, None]
+	for _ in range(maxsteps):
+		mean_, cov_ = csteps(X, mean, cov, h, ridge, 1)
+		if determinant(cov_)[0] >= determinant(cov)[0] * (1 - 1e-9):
+			break
+		mean, cov = mean_, cov_
+	mean, cov = mean[0], cov[0] * np.median(distances(X, mean, cov)) / MEDIAN
+
+	inside = Ellipse(mean, cov).distances(X) <= CUTOFF
+	mean, cov = estimate(X, np.flatnonzero(inside)[None], ridge)
+	return Ellipse(mean[0], cov[0] / TRUNCATED)
+
+def points(D, leader_names, minsize=0):
+	# the precincts square.histograms bins, as turnout and leader's result in % with the counts they come from
+	D = election_data.filter(D, ballots_valid_invalid_min=1, voters_registered_min=max(minsize, 1), voters_voted_le_voters_registered=True, foreign=False)
+	leader = election_data.find_leader_score(D, leader_names).astype(np.float64)
+	X = np.stack([100 * D.voters_voted / D.voters_registered, 100 * leader / D.ballots_valid_invalid], axis=1)
+	return D, X, D.voters_registered.astype(np.float64), leader
+
+def anomalies(X, registered, leader, ellipse):
+	# precincts outside the ellipse with both turnout and result above its center, and the leader's ballots in them
+	# beyond what a precinct of the same size at the center would give
+	t0, r0 = ellipse.mean
+	anomalous = (ellipse.distances(X) > ellipse.cutoff) & (X[:, 0] > t0) & (X[:, 1] > r0)
+	excess = np.sum(np.maximum(leader - registered * t0 * r0 / 1e4, 0)[anomalous])
+	return dict(precincts=len(X), anomalous=int(np.count_nonzero(anomalous)), share=np.count_nonzero(anomalous) / max(len(X), 1), excess=excess, turnout=t0, result=r0)
+
+def work(arrays, start, stop, **kwargs):
+	X, registered, leader = (a[start:stop] for a in arrays)
+	ellipse = fit(X, **kwargs)
+	return ellipse, anomalies(X, registered, leader, ellipse)
+
+@spans.traced('mcd')
+def analyze(D, leader_names, minsize=0, smallest=50, jobs=1, **kwargs):
+	# The national fit and one fit per region with at least smallest precincts, in a process pool if jobs > 1 (the
+	# points are sent to every worker once). Returns {region_code: (title, ellipse, anomalies)}, the nation under ''.
+	I = D if isinstance(D, election_data.Index) else election_data.Index(D)
+	D, X, registered, leader = points(I, leader_names, minsize=minsize)
+	I = election_data.Index(D)
+	R = election_data.regions(I)
+	tasks = {'': (0, len(X))}
+	tasks.update((r, (I.slice(r).start, I.slice(r).stop)) for r in R if I.slice(r).stop - I.slice(r).start >= smallest)
+
+	results = dict(zip(tasks, workers.run(work, (X, registered, leader), tasks.values(), jobs=jobs, **kwargs)))
+	return {r: (R.get(r, 'all'),) + results[r] for r in tasks}
+
+if __name__ == '__main__':
+	import argparse
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('data', nargs='?', metavar='DATA', default='https://github.com/schitaytesami/lab/releases/download/data-v2/RU_2018-03-18_president.tsv.gz', help='Data file to use')
+	parser.add_argument('--min-size', default=0, type=int, help='Minimum precinct size to include')
+	parser.add_argument('--smallest', default=50, type=int, help='Minimum number of precincts for a region to get its own fit')
+	parser.add_argument('--support', default=None, type=float, help='Share of precincts the raw ellipse covers (default about half, the most robust)')
+	parser.add_argument('-j', '--jobs', default=1, type=int, help='Number of processes fitting regions in parallel')
+	parser.add_argument('--profile', metavar='FILE', help='Write a Chrome trace of the stages to FILE (or set ELECTION_DATA_PROFILE)')
+	args = parser.parse_args()
+	spans.enable(args.profile)
+
+	results = analyze(election_data.load(args.data), election_data.RU_LEADER, minsize=args.min_size, smallest=args.smallest, jobs=args.jobs, support=args.support)
+	print('region', 'precincts', 'anomalous', 'share', 'excess', 'turnout', 'result', 'name', sep='\t')
+	for r, (title, ellipse, a) in sorted(results.items(), key=lambda kv: -kv[1][2]['excess']):
+		print(r or 'all', a['precincts'], a['anomalous'], f'{a["share"]:.1%}', f'{a["excess"]:.0f}', f'{a["turnout"]:.1f}', f'{a["result"]:.1f}', title, sep='\t')
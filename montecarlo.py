@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# python3 montecarlo.py RU_2018-03-18_president.tsv.gz --mode binomial --replicates 10000 -j 8
+#
+# Confidence bands of the turnout and leader's result histograms of square.py, and the counts of integer-percentage
+# precincts against what the binomial resamples give. On one core, with ~97k precincts and the default 0.25% bins,
+# a replicate takes about 4.5 ms in noise mode (45 s for 10k) and 45 ms in binomial mode (7.5 min for 10k), where
+# the binomial draws are 60% of the time and integers.counts another 15%. The replicates are drawn in independent
+# batches with no state shared but the input columns, so -j N divides these times by up to N cores.
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+import election_data
+import integers
+import spans
+import square
+import workers
+
+def replicates(rng, count, voted, registered, leader, valid, *, binwidth, weights, mode, batch):
+	# count resamples of the turnout and leader's result histograms, batch of them at a time as (batch, precincts) arrays
+	edges = np.arange(-binwidth/2, 100 + binwidth/2, binwidth)
+	nbin = len(edges) + 1
+	turnout = np.clip(voted / np.maximum(registered, 1), 0, 1)
+	share = np.clip(leader / valid, 0, 1)
+	weight = {'voters': registered, 'given': voted, 'leader': leader, 'ones': None}[weights]
+
+	# The noise moves a numerator by less than 0.5, so a precinct whose whole range of turnouts (or results) falls in
+	# one bin is in that bin in every replicate: those are binned once, only the others are drawn per batch. Most of
+	# those straddle a single edge and are binned by comparing with it, only the rest go through square.binindex.
+	if mode == 'noise':
+		noise = []
+		for numerator, denominator in [(voted, registered), (leader, valid)]:
+			lo, hi = square.binindex(100 * (numerator - .5) / denominator, edges), square.binindex(100 * (numerator + .5) / denominator, edges)
+			pair, other = np.flatnonzero((hi == lo + 1) & (hi < len(edges))), np.flatnonzero((lo != hi) & ~((hi == lo + 1) & (hi < len(edges))))
+			m = np.concatenate([pair, other])
+			h = np.bincount(lo[lo == hi], weights=weight[lo == hi] if weight is not None else None, minlength=nbin)[1:-1]
+			noise.append((numerator[m], denominator[m], weight[m] if weight is not None else None, len(pair), lo[pair], edges[lo[pair]], h))
+
+	HT, HR, C = np.empty((count, nbin - 2)), np.empty((count, nbin - 2)), {}
+	for lo in range(0, count, batch):
+		b = min(batch, count - lo)
+		rows = nbin * np.arange(b)[:, None]
+		if mode == 'binomial':
+			voted_, leader_ = rng.binomial(registered, turnout, size=(b, len(registered))), rng.binomial(valid, share, size=(b, len(valid)))
+			for k, v in integers.counts(voted_, registered, leader_, valid).items():
+				C.setdefault(k, np.empty(count, dtype=int))[lo : lo + b] = v
+			wval = {'voters': np.broadcast_to(registered, voted_.shape), 'given': voted_, 'leader': leader_, 'ones': None}[weights]
+			# the denominators of square.histograms: a precinct with no registered voters is nan and falls out of the bins
+			with np.errstate(divide='ignore', invalid='ignore'):
+				z = [100 * voted_ / registered, 100 * leader_ / valid]
+			for H, z in zip([HT, HR], z):
+				H[lo : lo + b] = np.bincount((rows + square.binindex(z, edges)).ravel(), weights=wval.ravel() if wval is not None else None, minlength=b * nbin).reshape(b, nbin)[:, 1:-1]
+		else:
+			for H, (numerator, denominator, w, k, lo_, edge, h) in zip([HT, HR], noise):
+				z = 100 * (numerator + rng.random((b, len(numerator))) - .5) / denominator
+				i = np.empty(z.shape, dtype=np.intp)
+				i[:, :k] = lo_ + (z[:, :k] >= edge)
+				i[:, k:] = square.binindex(z[:, k:], edges)
+				H[lo : lo + b] = h + np.bincount((rows + i).ravel(), weights=np.broadcast_to(w, z.shape).ravel() if w is not None else None, minlength=b * nbin).reshape(b, nbin)[:, 1:-1]
+	return HT, HR, C
+
+def work(arrays, seed, count, **kwargs):
+	return replicates(np.random.default_rng(seed), count, *arrays, **kwargs)
+
+@spans.traced('resample')
+def resample(D, leader_names, *, binwidth=0.25, weights='voters', minsize=0, mode='noise', count=1000, batch=64, jobs=1, seed=1):
+	# Monte-Carlo bands for the turnout and leader's result histograms of square.histogram. mode='noise' redraws the
+	# U(-0.5, 0.5) noise added to the numerators, mode='binomial' redraws the ballots given and the leader's ballots
+	# from binomials with the observed rates (and counts the integer percentages of every replicate). Every batch gets
+	# its own Generator stream spawned from seed, so the result does not depend on jobs.
+	wlbl, centers, h, ht, hr = square.histograms(D, leader_names, [(binwidth, weights, minsize, False)])[0]
+	D = election_data.filter(D, ballots_valid_invalid_min=1, voters_registered_min=minsize, voters_voted_le_voters_registered=True, foreign=False)
+	arrays = (D.voters_voted.astype(np.int64), D.voters_registered.astype(np.int64), election_data.find_leader_score(D, leader_names).astype(np.int64), D.ballots_valid_invalid.astype(np.int64))
+
+	tasks = [(s, min(batch, count - lo)) for s, lo in zip(np.random.SeedSequence(seed).spawn((count + batch - 1) // batch), range(0, count, batch))]
+	kwargs = dict(binwidth=binwidth, weights=weights, mode=mode, batch=batch)
+	results = workers.run(work, arrays, tasks, jobs=jobs, **kwargs)
+
+	HT = np.concatenate([r[0] for r in results])
+	HR = np.concatenate([r[1] for r in results])
+	C = {k: np.concatenate([r[2][k] for r in results]) for k in results[0][2]}
+	return wlbl, centers, ht, hr, HT, HR, integers.counts(*arrays), C
+
+def plot(D, leader_names, title, binwidth=0.25, quantiles=(0.025, 0.975), **kwargs):
+	wlbl, centers, ht, hr, HT, HR, counts, C = resample(D, leader_names, binwidth=binwidth, **kwargs)
+
+	plt.suptitle(title, size=20, y=0.95, va='baseline')
+	for subplot, h, H, xlabel in [(211, ht, HT, 'Turnout %'), (212, hr, HR, 'Leader’s result %')]:
+		plt.subplot(subplot)
+		lo, hi = np.quantile(H, quantiles, axis=0)
+		plt.fill_between(centers, lo, hi, step='mid', color='tab:orange', alpha=0.5, linewidth=0, label=f'{quantiles[0]:.1%}–{quantiles[1]:.1%} of {len(H)} resamples')
+		plt.plot(centers, h, linewidth=1, color='black', drawstyle='steps-mid', label='observed')
+		plt.xticks(np.arange(0, 101, 10))
+		plt.xlim(0, 100)
+		plt.ylim(bottom=0)
+		plt.xlabel(xlabel)
+		plt.ylabel(f'{wlbl} in ${binwidth}\\,\\%$ bin')
+		plt.legend(loc='upper left')
+	plt.subplots_adjust(hspace=0.3)
+	return counts, C
+
+if __name__ == '__main__':
+	import os
+	import argparse
+	import matplotlib
+	matplotlib.use('Agg')
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('data', nargs='?', metavar='DATA', default='https://github.com/schitaytesami/lab/releases/download/data-v2/RU_2018-03-18_president.tsv.gz', help='Data file to use')
+	parser.add_argument('--bin-width', default=0.25, type=float, help='Bin width in percentage points')
+	parser.add_argument('--weights', default='voters', choices={'voters', 'given', 'leader', 'ones'}, help="'ones' (counts polling stations), 'voters' (counts registered voters), 'given' (counts ballots given), or 'leader' (counts ballots for the leader)")
+	parser.add_argument('--min-size', default=0, type=int, help='Minimum precinct size to include')
+	parser.add_argument('--mode', default='noise', choices={'noise', 'binomial'}, help="'noise' (redraw the U(-0.5,0.5) noise of the numerators) or 'binomial' (redraw ballots given and leader's ballots from the observed rates)")
+	parser.add_argument('--replicates', default=1000, type=int, help='Number of resamples')
+	parser.add_argument('--batch', default=64, type=int, help='Number of resamples drawn at once')
+	parser.add_argument('-j', '--jobs', default=1, type=int, help='Number of processes drawing resamples in parallel')
+	parser.add_argument('--seed', default=1, type=int, help='Seed of the random streams')
+	parser.add_argument('-o', '--output', default='montecarlo.png', help='Output file')
+	parser.add_argument('--profile', metavar='FILE', help='Write a Chrome trace of the stages to FILE (or set ELECTION_DATA_PROFILE)')
+	args = parser.parse_args()
+	spans.enable(args.profile)
+
+	D = election_data.load(args.data)
+
+	plt.figure(figsize=(9, 9))
+	counts, C = plot(D, leader_names=election_data.RU_LEADER, title=os.path.basename(args.data), binwidth=args.bin_width, weights=args.weights, minsize=args.min_size, mode=args.mode, count=args.replicates, batch=args.batch, jobs=args.jobs, seed=args.seed)
+	with spans.span('savefig'):
+		plt.savefig(args.output, bbox_inches='tight')
+	plt.close()
+
+	for k, v in counts.items():
+		print(k, v, *([f'expected {np.mean(C[k]):.1f} [{np.quantile(C[k], 0.025):.0f}, {np.quantile(C[k], 0.975):.0f}]'] if k in C else []), sep='\t')
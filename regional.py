@@ -0,0 +1,54 @@
+import concurrent.futures
+import os
+import tempfile
+import time
+
+import matplotlib
+import matplotlib.pyplot as plt
+
+import election_data
+import spans
+
+@spans.traced('savefig')
+def savefig(draw, args, kwargs, path, figsize, dpi):
+	tic = time.perf_counter()
+	plt.figure(figsize=figsize)
+	draw(*args, **kwargs)
+	plt.savefig(path, bbox_inches='tight', dpi=dpi)
+	plt.close()
+	return time.perf_counter() - tic
+
+shared = {}
+
+def attach(path=None):
+	matplotlib.use('Agg')
+	if path is not None:
+		shared[path] = election_data.memmap(path)
+
+def savefig_shared(plot, path, start, stop, title, output, figsize, dpi):
+	# one region of a dataset that the main process wrote out, mapped once per worker
+	if path not in shared:
+		shared[path] = election_data.memmap(path)
+	return savefig(plot, (shared[path][start:stop],), dict(title=title), output, figsize, dpi)
+
+def render(plot, D, output, dpi=None, jobs=1, figsize=(12, 8), slowest=5):
+	# One figure per region. With jobs > 1 the indexed dataset is written out once and memory-mapped
+	# by the workers, so a task only carries the offsets of its region.
+	D = D if isinstance(D, election_data.Index) else election_data.Index(D)
+	R = election_data.regions(D)
+	timings = {}
+	if jobs == 1:
+		for region_code in R:
+			timings[region_code] = savefig(plot, (election_data.filter(D, region_code=region_code),), dict(title=R[region_code]), os.path.join(output, region_code + '.png'), figsize, dpi)
+			print(region_code, f'{timings[region_code]:.2f}s')
+	else:
+		with tempfile.TemporaryDirectory() as tmp:
+			election_data.save(os.path.join(tmp, 'D.npy'), D.D)
+			with concurrent.futures.ProcessPoolExecutor(jobs, initializer=attach, initargs=(os.path.join(tmp, 'D.npy'),)) as pool:
+				futures = {pool.submit(savefig_shared, plot, os.path.join(tmp, 'D.npy'), D.slice(region_code).start, D.slice(region_code).stop, R[region_code], os.path.join(output, region_code + '.png'), figsize, dpi): region_code for region_code in R}
+				for future in concurrent.futures.as_completed(futures):
+					timings[futures[future]] = future.result()
+					print(futures[future], f'{timings[futures[future]]:.2f}s')
+
+	print('slowest:', ', '.join(f'{region_code} {t:.2f}s' for region_code, t in sorted(timings.items(), key=lambda kv: -kv[1])[:slowest]))
+	return timings
@@ -1,39 +1,51 @@
 #!/usr/bin/env python3
 
 # python3 ru_election_data.py --date 2018-03-18 --name president --protocols shpilkin/protocols_227_json.txt --turnouts shpilkin/ik_turnouts_json.txt --locations shpilkin/uiks_from_cikrf_json.txt _RU_2018-03-18_president.tsv.gz
+#
+# Memory grows with the number of precincts, not with the size of the feeds: the feeds are read a block at a time,
+# every precinct is one slotted record (about 2 KB with its strings and votes, some 200 MB for the ~97k precincts of a
+# federal election) and the rows are written out as they are built. It is not bounded by a constant: a precinct can
+# come up anywhere in any of the three feeds, so every record is kept until the last feed is read, and the number of
+# candidate columns of the header is only known then.
 
 
 import argparse
 import collections
+import concurrent.futures
+import contextlib
 import csv
-import io
+import gzip
 import json
 import os.path
+import sys
+import time
 import urllib.parse
-import urllib.request
-
-import election_data
 
+import numpy as np
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--glossary', default=os.path.join(os.path.dirname(__file__), 'ru_election_data.json'))
-parser.add_argument('--protocols')
-parser.add_argument('--turnouts')
-parser.add_argument('--locations')
-parser.add_argument('--bad-json')
-parser.add_argument('--date')
-parser.add_argument('--name')
-parser.add_argument('output', nargs='?', metavar='OUTPUT')
-args = parser.parse_args()
+import election_data
+import fetch
+import spans
 
 
+@contextlib.contextmanager
 def argopen(url):
-	return urllib.request.urlopen(url) if '//' in url else open(url, 'rb')
+	# gzip does not close the file it wraps, closing a download also finishes its mirror copy
+	with fetch.open(url) if '//' in url else open(url, 'rb') as file:
+		if url.endswith('.gz'):
+			with gzip.open(file) as file:
+				yield file
+		else:
+			yield file
 
-def jsons(file):
-	# TODO gzip, json-seq support?
-	file = io.TextIOWrapper(file, encoding='utf-8')
-	return (json.loads(line) for line in file if line)
+def blocks(file, size=1 << 22):
+	# TODO json-seq support?
+	while True:
+		with spans.span('read'):
+			lines = file.readlines(size)
+		if not lines:
+			return
+		yield b''.join(lines)
 
 def coord(s):
 	return float(s.replace(' ', '') if s else 'nan')
@@ -41,14 +53,31 @@ def coord(s):
 def letters(s):
 	return ''.join(c for c in s if c.isalpha() or c.isspace())
 
-def regioncode(name):
-	codes = [r
-	         for r, pats in glossary['regions'].items()
-	         for pat in pats
-	         if pat in name]
-	if len(codes) != 1:
-		bad['regions'].add(name)
-	return codes[0] if codes else ''
+def regionmatcher(regions, bad):
+	# regioncode() for a glossary: the patterns are flattened once and every distinct
+	# name is matched only the first time it is seen, the feeds repeat a few hundred names
+	patterns = [(pat, r) for r, pats in regions.items() for pat in pats]
+	memo = {}
+	def regioncode(name):
+		if name not in memo:
+			codes = [r for pat, r in patterns if pat in name]
+			if len(codes) != 1:
+				bad['regions'].add(name)
+			memo[name] = codes[0] if codes else ''
+		return memo[name]
+	return regioncode
+
+def linematcher(fields):
+	# For every distinct protocol line name, worked out once: the fields it adds into, with the number of
+	# their patterns it contains (each match adds the value once), and its name if it is a candidate or a party
+	memo = {}
+	def lineclass(k):
+		if k not in memo:
+			targets = tuple((f, n) for f, pats in fields.items() for n in [sum(pat in k for pat in pats)] if n)
+			name = letters(k)
+			memo[k] = targets, sys.intern(name) if name.istitle() or 'партия' in k.lower() else None
+		return memo[k]
+	return lineclass
 
 def precinctnumber(name):
 	if name[0].isdigit():
@@ -57,157 +86,281 @@ def precinctnumber(name):
 		num = ''.join(c for c in name if c.isdigit())
 		return int(num) if num else -1
 
-def precinct(loc):
+def locate(loc, regioncode):
 	if len(loc) < 3:
 		return None
-	prefixes.add(tuple(loc[:-1]))
-
-	region_name = loc[0]
-	region_code = regioncode(region_name)
+	region_code = regioncode(loc[0])
 	uik_num = precinctnumber(loc[-1])
 	if uik_num < 0:
 		return None
+	return loc, region_code, uik_num
+
+worker = None
+
+def setup(glossary):
+	global worker
+	bad = collections.defaultdict(set)
+	worker = glossary, bad, regionmatcher(glossary['regions'], bad), linematcher(glossary['fields'])
+
+def normalize(feed, block):
+	# Decodes one block of whole lines of a feed into plain tuples for merge(), this is the part that runs in
+	# the pool. Returns the number of records, the tuples, and the bad entries first seen in this block.
+	glossary, bad, regioncode, lineclass = worker
+	n, records = 0, []
+	for line in block.split(b'\n'):
+		if not line.strip():
+			continue
+		n += 1
+		obj = json.loads(line)
+
+		if feed == 'turnouts':
+			located = locate(obj['loc'], regioncode)
+			if located is not None:
+				records.append((located, tuple(obj['turnouts'].get(t, float('nan')) for t in glossary['turnouts'].values())))
 
+		elif feed == 'protocols':
+			located = locate(obj['loc'], regioncode)
+			if located is None:
+				continue
+
+			lines = obj['data']
+			if isinstance(lines, list):
+				lines = {l['line_name']: l['line_val'] for l in lines}
+
+			sums, vote = {}, {}
+			for k, v in lines.items():
+				targets, name = lineclass(k)
+				for f, m in targets:
+					sums[f] = sums.get(f, 0) + m * int(v)
+				if name is not None:
+					vote[name] = int(v)
+
+			for f in glossary['fields']:
+				if f not in sums:
+					bad[f].update(lines)
+			records.append((located, sums, tuple(vote.items())))
+
+		elif feed == 'locations':
+			records.append((regioncode(obj['region']), obj['region'], precinctnumber(obj['text']),
+			                obj['address'].strip().replace('\t', ' '), coord(obj['coords']['lat']), coord(obj['coords']['lon']),
+			                obj['voteaddress'].strip().replace('\t', ' '), coord(obj['votecoords']['lat']), coord(obj['votecoords']['lon'])))
+
+	found = {k: set(v) for k, v in bad.items()}
+	bad.clear()
+	return n, records, found
+
+def pipeline(tasks, glossary, jobs=1):
+	# normalize() over (feed, block) tasks, in a process pool if jobs > 1, yielding the results in task order
+	# with at most 2 * jobs blocks in flight
+	if jobs == 1:
+		setup(glossary)
+		for feed, block in tasks:
+			with spans.span('normalize', feed=feed):
+				result = normalize(feed, block)
+			yield feed, result
+		return
+	with concurrent.futures.ProcessPoolExecutor(jobs, initializer=setup, initargs=(glossary,)) as pool:
+		pending = collections.deque()
+		for feed, block in tasks:
+			pending.append((feed, pool.submit(normalize, feed, block)))
+			if len(pending) > 2 * jobs:
+				feed, future = pending.popleft()
+				yield feed, wait(feed, future)
+		for feed, future in pending:
+			yield feed, wait(feed, future)
+
+def wait(feed, future):
+	# the workers' own spans are lost with them, the main process records how long it waits on each block
+	with spans.span('wait', feed=feed):
+		return future.result()
+
+def precinct(located):
+	loc, region_code, uik_num = located
 	p = precincts[region_code, uik_num]
-	p['loc'] = loc
-	p['region_code'] = region_code
+	p.loc = tuple(map(sys.intern, loc))
+	p.region_code = region_code
 	if region_code:
-		p['region_name'] = glossary['regions'][region_code][0]
-		p['foreign'] = 1 if region_code.endswith('-FRN') else 0
+		p.region_name = glossary['regions'][region_code][0]
+		p.foreign = 1 if region_code.endswith('-FRN') else 0
 	else:
-		p['region_name'] = region_name
-	p['precinct'] = uik_num
+		p.region_name = loc[0]
+	p.precinct = uik_num
 	return p
 
-
-glossary = json.load(open(args.glossary))
-precincts = collections.defaultdict(lambda: dict(empty))
-prefixes = set()
-bad = collections.defaultdict(set)
-
-empty = {
-	'region_code': None,
-	'region_name': None,
-	'foreign': -1,
-	'oik_num': -1,
-	'district': None,
-	'tik_num': -1,
-	'territory': None,
-	'precinct': -1,
-	'electoral_id': None,
-	'commission_address': None,
-	'commission_lat': 'nan',
-	'commission_lon': 'nan',
-	'station_address': None,
-	'station_lat': 'nan',
-	'station_lon': 'nan',
-	'voters_voted': -1,
-}
-empty.update((k, -1) for k in glossary['fields'].keys())
-empty.update((k, 'nan') for k in glossary['turnouts'].keys())
-
-
-# Turnouts
-
-if args.turnouts is not None:
-	for obj in jsons(argopen(args.turnouts)):
-		p = precinct(obj['loc'])
-		if p is None:
-			continue
-		for k, t in glossary['turnouts'].items():
-			p[k] = format(obj['turnouts'].get(t, float('nan')), '.4f')
-
-
-# Protocols
-
-if args.protocols is not None:
-	for obj in jsons(argopen(args.protocols)):
-		p = precinct(obj['loc'])
-		if p is None:
-			continue
-
-		lines = obj['data']
-		if isinstance(lines, list):
-			lines = {l['line_name']: l['line_val'] for l in lines}
-
-		for f, pats in glossary['fields'].items():
-			if not any(pat in k for pat in pats for k in lines.keys()):
-				bad[f].update(lines)
-				continue
-			p[f] = sum(int(v)
-				   for pat in pats
-				   for k, v in lines.items()
-				   if pat in k)
-
-		p['vote'] = {letters(k): int(v)
-			     for k, v in lines.items()
-			     if letters(k).istitle() or 'партия' in k.lower()}
-
-		if p['voters_voted_at_station'] >= 0:
-			p['voters_voted'] = (p['voters_voted_at_station'] +
-				             max(0, p.get('voters_voted_early', -1)) +
-				             max(0, p.get('voters_voted_outside_station', -1)))
-
-
-# Locations
-
-if args.locations is not None:
-	for obj in jsons(argopen(args.locations)):
-		region_code = regioncode(obj['region'])
-		uik_num = precinctnumber(obj['text'])
-		p = precincts[region_code, uik_num]
-		p['region_code'] = region_code
-		if region_code:
-			p['region_name'] = glossary['regions'][region_code][0]
-			p['foreign'] = 1 if region_code.endswith('-FRN') else 0
-		else:
-			p['region_name'] = obj['region']
-
-		p['precinct'] = uik_num
-		p['commission_address'] = obj['address'].strip().replace('\t', ' ')
-		p['commission_lat'] = format(coord(obj['coords']['lat']), '.6f')
-		p['commission_lon'] = format(coord(obj['coords']['lon']), '.6f')
-		p['station_address'] = obj['voteaddress'].strip().replace('\t', ' ')
-		p['station_lat'] = format(coord(obj['votecoords']['lat']), '.6f')
-		p['station_lon'] = format(coord(obj['votecoords']['lon']), '.6f')
-
-
-# Postprocessing
-
-num_candidates = max(len(p.get('vote', {})) for p in precincts.values())
-for p in precincts.values():
-	vote = p.pop('vote', {})
-	for i, (k, v) in enumerate(vote.items()):
-		p['candidate{}_name'.format(i)] = k
-		p['candidate{}_ballots'.format(i)] = v
-	for i in range(len(vote), num_candidates):
-		p['candidate{}_name'.format(i)] = ''
-		p['candidate{}_ballots'.format(i)] = -1
-
-	loc = p.pop('loc', None)
-	if loc is None:
-		continue
-	if len(loc) > 3:
-		oik_num, *oik_name = loc[1].split()
-		p['oik_num'] = int(oik_num)
-		p['district'] = ' '.join(oik_name)
-	tik_num, *tik_name = loc[-2].split()
-	p['tik_num'] = int(tik_num)
-	p['territory'] = tik_name = ' '.join(tik_name).replace('Территориальная избирательная комиссия', 'ТИК').replace('города', 'г.').replace('района', 'р-на')
-	p['electoral_id'] = election_data.electoral_id(region_code=p['region_code'], date=args.date, election_name=args.name, station=p['precinct'], territory=p['tik_num'], district=p['oik_num'] if p['oik_num'] >= 0 else None)
-
-if args.bad_json is not None:
-	with open(args.bad_json, 'w', newline='\r\n') as file:
-		json.dump({k: sorted(v) for k, v in bad.items()}, file, ensure_ascii=False, indent=2, sort_keys=True)
-
-fields  = list(empty.keys())
-fields += ['candidate{}_name'.format(i) for i in range(num_candidates)]
-fields += ['candidate{}_ballots'.format(i) for i in range(num_candidates)]
-
-with open(args.output, 'w', newline='\r\n') as out:
-	wr = csv.DictWriter(out, fieldnames=fields, dialect=None, delimiter='\t', lineterminator='\n', quotechar=None, quoting=csv.QUOTE_NONE)
-	wr.writeheader()
-	for p in precincts.values():
-		if p.pop('loc', ()) in prefixes:
-			continue
-		wr.writerow(p)
+def merge(feed, records):
+	for record in records:
+		if feed == 'turnouts':
+			located, values = record
+			p = precinct(located)
+			for k, v in zip(glossary['turnouts'], values):
+				setattr(p, k, v)
+
+		elif feed == 'protocols':
+			located, sums, vote = record
+			p = precinct(located)
+			for f, v in sums.items():
+				setattr(p, f, v)
+			p.vote = tuple((sys.intern(k), v) for k, v in vote)
+
+			if p.voters_voted_at_station >= 0:
+				p.voters_voted = (p.voters_voted_at_station +
+				                  max(0, p.voters_voted_early) +
+				                  max(0, p.voters_voted_outside_station))
+
+		elif feed == 'locations':
+			region_code, region_name, uik_num, p_commission_address, p_commission_lat, p_commission_lon, p_station_address, p_station_lat, p_station_lon = record
+			p = precincts[region_code, uik_num]
+			p.region_code = region_code
+			if region_code:
+				p.region_name = glossary['regions'][region_code][0]
+				p.foreign = 1 if region_code.endswith('-FRN') else 0
+			else:
+				p.region_name = region_name
+
+			p.precinct = uik_num
+			p.commission_address = p_commission_address
+			p.commission_lat = p_commission_lat
+			p.commission_lon = p_commission_lon
+			p.station_address = p_station_address
+			p.station_lat = p_station_lat
+			p.station_lon = p_station_lon
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--glossary', default=os.path.join(os.path.dirname(__file__), 'ru_election_data.json'))
+	parser.add_argument('--protocols')
+	parser.add_argument('--turnouts')
+	parser.add_argument('--locations')
+	parser.add_argument('--bad-json')
+	parser.add_argument('--date')
+	parser.add_argument('--name')
+	parser.add_argument('--npz', help='Also write the dataset as columns with explicit types (see election_data.load)')
+	parser.add_argument('-j', '--jobs', default=1, type=int, help='Number of processes decoding the feeds in parallel')
+	parser.add_argument('output', nargs='?', metavar='OUTPUT')
+	parser.add_argument('--profile', metavar='FILE', help='Write a Chrome trace of the stages to FILE (or set ELECTION_DATA_PROFILE)')
+	args = parser.parse_args()
+	spans.enable(args.profile)
+
+	with open(args.glossary) as file:
+		glossary = json.load(file)
+	bad = collections.defaultdict(set)
+
+	empty = {
+		'region_code': None,
+		'region_name': None,
+		'foreign': -1,
+		'oik_num': -1,
+		'district': None,
+		'tik_num': -1,
+		'territory': None,
+		'precinct': -1,
+		'electoral_id': None,
+		'commission_address': None,
+		'commission_lat': float('nan'),
+		'commission_lon': float('nan'),
+		'station_address': None,
+		'station_lat': float('nan'),
+		'station_lon': float('nan'),
+		'voters_voted': -1,
+	}
+	empty.update((k, -1) for k in glossary['fields'].keys())
+	empty.update((k, float('nan')) for k in glossary['turnouts'].keys())
+	formats = {k: '.6f' for k in ['commission_lat', 'commission_lon', 'station_lat', 'station_lon']}
+	formats.update((k, '.4f') for k in glossary['turnouts'].keys())
+
+	# One slotted record per precinct instead of a dict, with the numbers kept as numbers and formatted on output
+	# and the repeated strings (location parts, candidate names) interned
+	class Precinct:
+		__slots__ = tuple(empty) + ('loc', 'vote')
+
+		def __init__(self):
+			for k, v in empty.items():
+				setattr(self, k, v)
+			self.loc = None
+			self.vote = ()
+
+	precincts = collections.defaultdict(Precinct)
+
+
+	# Turnouts, protocols and locations, decoded block by block (in parallel with --jobs) and merged in file order
+
+	def tasks():
+		for feed in ['turnouts', 'protocols', 'locations']:
+			if getattr(args, feed) is not None:
+				with argopen(getattr(args, feed)) as file:
+					for block in blocks(file):
+						yield feed, block
+
+	tic = time.perf_counter()
+	counts, badcounts, times = collections.Counter(), collections.Counter(), {}
+	for feed, (n, records, found) in pipeline(tasks(), glossary, jobs=args.jobs):
+		with spans.span('merge', feed=feed):
+			merge(feed, records)
+		for k, v in found.items():
+			badcounts[feed] += len(v - bad[k])
+			bad[k].update(v)
+		counts[feed] += n
+		times[feed] = time.perf_counter()
+	for feed in counts:
+		rate = counts[feed] / max(times[feed] - tic, 1e-9)
+		print(f'{feed}: {counts[feed]} records, {rate:.0f} records/s, {badcounts[feed]} bad entries', file=sys.stderr)
+		spans.counter(feed, records=counts[feed], records_per_s=round(rate), bad=badcounts[feed])
+		tic = times[feed]
+
+
+	# Postprocessing: the parts of the location, then the electoral ids of all located precincts at once,
+	# then one row at a time as it is written out
+
+	def postprocess(p):
+		loc = p.loc
+		if loc is not None:
+			if len(loc) > 3:
+				oik_num, *oik_name = loc[1].split()
+				p.oik_num = int(oik_num)
+				p.district = ' '.join(oik_name)
+			tik_num, *tik_name = loc[-2].split()
+			p.tik_num = int(tik_num)
+			p.territory = ' '.join(tik_name).replace('Территориальная избирательная комиссия', 'ТИК').replace('города', 'г.').replace('района', 'р-на')
+
+	def row(p):
+		return ([format(getattr(p, k), formats[k]) if k in formats else getattr(p, k) for k in empty] +
+		        [k for k, v in p.vote] + [''] * (num_candidates - len(p.vote)) +
+		        [v for k, v in p.vote] + [-1] * (num_candidates - len(p.vote)))
+
+	with spans.span('postprocess', precincts=len(precincts)):
+		located = [p for p in precincts.values() if p.loc is not None]
+		for p in located:
+			postprocess(p)
+		ids = election_data.ELECTORAL_ID.encode([p.region_code for p in located], args.date, args.name, district=[p.oik_num if p.oik_num >= 0 else 0 for p in located], territory=[p.tik_num for p in located], station=[p.precinct for p in located])
+		for p, electoral_id in zip(located, ids.tolist()):
+			p.electoral_id = electoral_id
+
+	num_candidates = max(len(p.vote) for p in precincts.values())
+
+	if args.bad_json is not None:
+		with open(args.bad_json, 'w', newline='\r\n') as file:
+			json.dump({k: sorted(v) for k, v in bad.items()}, file, ensure_ascii=False, indent=2, sort_keys=True)
+
+	fields  = list(empty.keys())
+	fields += ['candidate{}_name'.format(i) for i in range(num_candidates)]
+	fields += ['candidate{}_ballots'.format(i) for i in range(num_candidates)]
+
+	# int32 counts, float64 coordinates and turnouts rounded as in the TSV, dictionary-encoded strings
+	kinds = {k: object if v is None else np.float64 if isinstance(v, float) else np.int32 for k, v in empty.items()}
+	kinds.update((k, object if k.endswith('_name') else np.int32) for k in fields[len(empty):])
+	T = np.empty(len(precincts), dtype=[(k, kinds[k]) for k in fields]) if args.npz is not None else None
+
+	with open(args.output, 'w', newline='\r\n') if args.output is not None else open(os.devnull, 'w') as out:
+		wr = csv.writer(out, dialect=None, delimiter='\t', lineterminator='\n', quotechar=None, quoting=csv.QUOTE_NONE)
+		wr.writerow(fields)
+		with spans.span('write', precincts=len(precincts)):
+			for i, p in enumerate(precincts.values()):
+				r = row(p)
+				wr.writerow(r)
+				if T is not None:
+					T[i] = tuple('' if v is None else v for v in r)
+
+	if T is not None:
+		with spans.span('savez'):
+			election_data.savez(args.npz, T)
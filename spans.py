@@ -0,0 +1,84 @@
+import atexit
+import collections
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+# Named spans around the stages of the pipeline. Enabled by --profile FILE or ELECTION_DATA_PROFILE=FILE, they are
+# written to FILE at exit in the Chrome trace format (chrome://tracing, ui.perfetto.dev) and summed up by name on
+# stderr (a nested span counts towards its parent too). Disabled, span() hands out one shared context manager that does nothing.
+events = None
+path = None
+
+def enable(file):
+	global events, path
+	if file and events is None:
+		events, path = [], file
+		atexit.register(write)
+
+class Span:
+	__slots__ = ('name', 'args', 'start')
+
+	def __init__(self, name, args):
+		self.name, self.args = name, args
+
+	def __enter__(self):
+		self.start = time.perf_counter_ns()
+		return self
+
+	def __exit__(self, *exc):
+		events.append(dict(name=self.name, ph='X', ts=self.start / 1000, dur=(time.perf_counter_ns() - self.start) / 1000, pid=os.getpid(), tid=threading.get_ident(), args=self.args))
+
+	def set(self, **args):
+		self.args.update(args)
+
+class Disabled:
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		pass
+
+	def set(self, **args):
+		pass
+
+disabled = Disabled()
+
+def span(name, **args):
+	return Span(name, args) if events is not None else disabled
+
+def traced(name):
+	# a span around every call of the decorated function
+	def decorate(f):
+		@functools.wraps(f)
+		def wrapper(*args, **kwargs):
+			if events is None:
+				return f(*args, **kwargs)
+			with Span(name, {}):
+				return f(*args, **kwargs)
+		return wrapper
+	return decorate
+
+def counter(name, **values):
+	if events is not None:
+		events.append(dict(name=name, ph='C', ts=time.perf_counter_ns() / 1000, pid=os.getpid(), tid=threading.get_ident(), args=values))
+
+def write():
+	with open(path, 'w') as file:
+		json.dump(dict(traceEvents=events, displayTimeUnit='ms'), file)
+
+	totals = collections.defaultdict(lambda: [0, 0.0, 0.0])
+	for e in events:
+		if e['ph'] == 'X':
+			t = totals[e['name']]
+			t[0], t[1], t[2] = t[0] + 1, t[1] + e['dur'] / 1e6, max(t[2], e['dur'] / 1e6)
+	for name, (count, total, longest) in sorted(totals.items(), key=lambda kv: -kv[1][1]):
+		print(f'{name}\t{count}x\t{total:.3f}s\tlongest {longest:.3f}s', file=sys.stderr)
+	for e in events:
+		if e['ph'] == 'C':
+			print(e['name'], *(f'{k} {v}' for k, v in e['args'].items()), sep='\t', file=sys.stderr)
+
+enable(os.environ.get('ELECTION_DATA_PROFILE'))
@@ -5,38 +5,129 @@ import matplotlib.pyplot as plt
 import matplotlib.gridspec 
 
 import election_data
+import mcd
+import spans
 
 # Settings used in our papers:
 # * AOAS-2016:				 binwidth=0.1,	addNoise=False, weights='voters', minsize = 0
 # * Significance-2016: binwidth=0.25, addNoise=True,	weights='ones',	 minsize = 0
 # * Significance-2018: binwidth=0.1,	addNoise=True,	weights='ones',	 minsize = 0
+PAPERS = {
+	'AOAS-2016':         (0.1,  'voters', 0, False),
+	'Significance-2016': (0.25, 'ones',   0, True),
+	'Significance-2018': (0.1,  'ones',   0, True),
+}
+
+WEIGHTS = {
+	'voters': 'voters registered',
+	'given':  'ballots given',
+	'leader': 'ballots for leader',
+	'ones':   'polling stations',
+}
+
+def binindex(x, edges):
+	# same binning as np.histogramdd: bin 0 and bin len(edges) catch the outliers (and nans),
+	# values equal to the last edge go into the last proper bin. The edges are uniform, so the index
+	# is computed arithmetically and then moved by one wherever rounding put x on the wrong side
+	# of the actual edge value, which gives exactly what searchsorted would.
+	n = len(edges)
+	with np.errstate(invalid='ignore'):
+		i = np.clip(np.nan_to_num(np.floor((x - edges[0]) / (edges[1] - edges[0])), nan=n, posinf=n, neginf=-1) + 1, 0, n).astype(np.intp)
+	e = np.concatenate([[-np.inf], edges, [np.inf]])
+	i -= x < e[i]
+	i += (x >= e[i + 1]) & (i < n)
+	i[x == edges[-1]] -= 1
+	return i
+
+@spans.traced('histogram')
+def histograms(D, leader_names, configs, seed=1):
+	# All (binwidth, weights, minsize, noise) configurations in one go: the data is filtered once, noise is drawn once
+	# per subset, bin indices are computed once per bin width and reused for every weight by np.bincount.
+	# Returns (wlbl, centers, h, ht, hr) for each configuration, h is identical to what np.histogram2d gives.
+	H = Histograms(leader_names, configs, seed=seed)
+	H.add(D)
+	return H.results()
+
+class Histograms:
+	# histograms() summed over a dataset that comes in chunks (see stream.py). The weights are counts, so the sums
+	# are exact and do not depend on how the rows are split. The noise of a minsize subset is one RandomState stream,
+	# its first n draws for the turnouts and the next n for the results; the chunks continue both, which takes the
+	# number n of precincts in advance: count() every chunk before add()ing them, or add() the whole dataset at once.
+	def __init__(self, leader_names, configs, seed=1):
+		self.leader_names, self.configs, self.seed = leader_names, [tuple(c) for c in configs], seed
+		self.sizes, self.streams = {}, {}
+		self.h = {c: np.zeros((len(np.arange(-c[0]/2, 100 + c[0]/2, c[0])) - 1,) * 2) for c in self.configs}
+
+	def select(self, D):
+		# the rows binned and the leader's ballots in them, None for a chunk with no such rows (where the leader's
+		# column cannot be looked up)
+		D = election_data.filter(D, ballots_valid_invalid_min=1, voters_voted_le_voters_registered=True, foreign=False)
+		return D, election_data.find_leader_score(D, self.leader_names) if len(D) else None
+
+	def count(self, D):
+		D, leader = self.select(D)
+		if leader is None:
+			return
+		for minsize in {minsize for binwidth, weights, minsize, noise in self.configs if noise}:
+			self.sizes[minsize] = self.sizes.get(minsize, 0) + np.count_nonzero(D.voters_registered >= minsize)
+
+	def noise(self, minsize, n):
+		if minsize not in self.streams:
+			turnouts, results = np.random.RandomState(self.seed), np.random.RandomState(self.seed)
+			skip = self.sizes.get(minsize, n)
+			for lo in range(0, skip, 1 << 20):
+				results.rand(min(1 << 20, skip - lo))
+			self.streams[minsize] = turnouts, results
+		turnouts, results = self.streams[minsize]
+		return turnouts.rand(n) - .5, results.rand(n) - .5
+
+	def add(self, D):
+		D, leader = self.select(D)
+		if leader is None:
+			return
+		subsets, values, indices = {}, {}, {}
+		for config in dict.fromkeys(self.configs):
+			binwidth, weights, minsize, noise = config
+			if minsize not in subsets:
+				idx = D.voters_registered >= minsize
+				subsets[minsize] = D[idx], leader[idx]
+			D_, leader_ = subsets[minsize]
+
+			if (minsize, noise) not in values:
+				noise1, noise2 = self.noise(minsize, len(D_)) if noise else (np.zeros(len(D_)), np.zeros(len(D_)))
+				values[minsize, noise] = 100 * (D_.voters_voted + noise1) / D_.voters_registered, 100 * (leader_ + noise2) / D_.ballots_valid_invalid
+
+			if (minsize, noise, binwidth) not in indices:
+				edges = np.arange(-binwidth/2, 100 + binwidth/2, binwidth)
+				x, y = values[minsize, noise]
+				indices[minsize, noise, binwidth] = binindex(x, edges) * (len(edges) + 1) + binindex(y, edges), len(edges) + 1
+
+			flat, nbin = indices[minsize, noise, binwidth]
+			wval = {
+				'voters': D_.voters_registered,
+				'given':  D_.voters_voted,
+				'leader': leader_,
+				'ones':   None,
+			}[weights]
+			self.h[config] += np.bincount(flat, weights=wval, minlength=nbin * nbin).reshape(nbin, nbin)[1:-1, 1:-1]
+
+	def merge(self, other):
+		for c in self.configs:
+			self.h[c] += other.h[c]
+
+	def results(self):
+		return [(WEIGHTS[weights], np.arange(0, 100, binwidth), self.h[c].copy(), np.sum(self.h[c], axis=1), np.sum(self.h[c], axis=0)) for c in self.configs for binwidth, weights, minsize, noise in [c]]
 
 def histogram(D, leader_names, *, binwidth, weights='voters', minsize=0, noise=False, seed=1):
-	rnd = np.random.RandomState(seed)
-	edges = np.arange(-binwidth/2, 100 + binwidth/2, binwidth)
-	centers = np.arange(0, 100, binwidth)
-
-	D = election_data.filter(D, ballots_valid_invalid_min=1, voters_registered_min=minsize, voters_voted_le_voters_registered=True, foreign=False)
-	leader = election_data.find_leader_score(D, leader_names)
-
-	wval, wlbl = {
-		'voters': (D.voters_registered, 'voters registered'),
-		'given':  (D.voters_voted, 'ballots given'),
-		'leader': (leader, 'ballots for leader'),
-		'ones':   (np.ones(D.voters_registered.shape), 'polling stations'),
-	}.get(weights)
-	noise1 = np.zeros(len(D)) if not noise else rnd.rand(len(D)) - .5
-	noise2 = np.zeros(len(D)) if not noise else rnd.rand(len(D)) - .5
-	h = np.histogram2d(100 * (D.voters_voted + noise1) / D.voters_registered,
-	                   100 * (leader + noise2) / D.ballots_valid_invalid,
-	                   bins=edges, weights=wval)[0]
+	wlbl, centers, h, ht, hr = histograms(D, leader_names, [(binwidth, weights, minsize, noise)], seed=seed)[0]
 	return wlbl, centers, h
 
-def plot(D, leader_names, title, binwidth=0.25, spacing=0.5, **kwargs):
-	wlbl, centers, h = histogram(D, leader_names, binwidth=binwidth, **kwargs)
-	ht = np.sum(h, axis=1)
-	hr = np.sum(h, axis=0)
+def plot(D, leader_names, title, binwidth=0.25, spacing=0.5, weights='voters', minsize=0, noise=False, seed=1, ellipse=False):
+	# ellipse=True also draws the robust ellipse of mcd.fit around the bulk of the precincts
+	draw(*histograms(D, leader_names, [(binwidth, weights, minsize, noise)], seed=seed)[0], title=title, binwidth=binwidth, spacing=spacing,
+	     ellipse=mcd.fit(mcd.points(D, leader_names, minsize=minsize)[1]) if ellipse else None)
 
+def draw(wlbl, centers, h, ht, hr, title, binwidth=0.25, spacing=0.5, ellipse=None):
 	ylog = int(np.ceil(np.log10(min(np.max(ht), np.max(hr))))) - 1
 
 	plt.suptitle(title, size=20, y=0.925, va='baseline')
@@ -51,6 +142,10 @@ def plot(D, leader_names, title, binwidth=0.25, spacing=0.5, **kwargs):
 
 	plt.subplot2grid((4, 4), (1, 0), colspan = 3, rowspan = 3)
 	plt.imshow(h.T, vmin=0, vmax=np.quantile(h[h>0], 0.95), origin='lower', extent=[0,100,0,100], interpolation='none')
+	if ellipse is not None:
+		plt.plot(*ellipse.boundary(), color='white', linewidth=1)
+		plt.xlim(0, 100)
+		plt.ylim(0, 100)
 	plt.axis('off')
 
 	plt.subplot2grid((4, 4), (1, 3), rowspan = 3)
@@ -79,12 +174,16 @@ if __name__ == '__main__':
 	parser.add_argument('--weights', default='voters', choices={'voters', 'given', 'leader', 'ones'}, help="'ones' (counts polling stations), 'voters' (counts registered voters), 'given' (counts ballots given), or 'leader' (counts ballots for the leader)")
 	parser.add_argument('--min-size', default=0, type=int, help='Minimum precinct size to include')
 	parser.add_argument('--noise', action='store_true', help='Add U(-0.5,0.5) noise to the numerators (to remove division artifacts)')
+	parser.add_argument('--ellipse', action='store_true', help='Draw the robust (MCD) ellipse around the bulk of the precincts')
 	parser.add_argument('-o', '--output', default='square.png', help='Output file')
+	parser.add_argument('--profile', metavar='FILE', help='Write a Chrome trace of the stages to FILE (or set ELECTION_DATA_PROFILE)')
 	args = parser.parse_args()
+	spans.enable(args.profile)
 
 	D = election_data.load(args.data)
 
 	plt.figure(figsize=(9, 9))
-	plot(D, leader_names = election_data.RU_LEADER, title=os.path.basename(args.data), binwidth=args.bin_width, weights=args.weights, minsize=args.min_size, noise=args.noise)
-	plt.savefig(args.output, bbox_inches='tight')
+	plot(D, leader_names = election_data.RU_LEADER, title=os.path.basename(args.data), binwidth=args.bin_width, weights=args.weights, minsize=args.min_size, noise=args.noise, ellipse=args.ellipse)
+	with spans.span('savefig'):
+		plt.savefig(args.output, bbox_inches='tight')
 	plt.close()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# python3 stream.py 2018.tsv.gz 2012.tsv.gz --square square.png --turnout turnout.png --history history.png -j 2
+#
+# The square, turnout and history figures of several elections pooled, or of a dataset too large to load: every file
+# is read a block of lines at a time (election_data.chunks) and only the histograms are kept, so memory does not grow
+# with the number of rows. Each file gives exactly the histograms square.histograms and history.histogram give for it
+# loaded whole, and the files, processed in parallel with -j, are summed in the order given.
+
+import concurrent.futures
+
+import election_data
+import history
+import spans
+import square
+import turnout
+
+def accumulate(path, leader_names, configs, histories=(), seed=1, blocksize=1 << 24):
+	# One file: a square.Histograms for the configurations and a history.Histogram for every (binwidth, minsize) of
+	# histories. With noise the precincts are counted in a first pass over the file (see square.Histograms).
+	with spans.span('stream', path=path):
+		S = square.Histograms(leader_names, configs, seed=seed)
+		H = [history.Histogram(binwidth=binwidth, minsize=minsize) for binwidth, minsize in histories]
+		if any(noise for binwidth, weights, minsize, noise in S.configs):
+			for D in election_data.chunks(path, blocksize=blocksize):
+				S.count(D)
+		for D in election_data.chunks(path, blocksize=blocksize):
+			S.add(D)
+			for h in H:
+				h.add(D)
+		return S, H
+
+def histograms(paths, leader_names, configs, histories=(), seed=1, blocksize=1 << 24, jobs=1):
+	# Returns what square.histograms gives for configs and history.histogram for each of histories, summed over the
+	# files in paths; with jobs > 1 the files are read in parallel, jobs of them at a time.
+	if jobs == 1:
+		results = [accumulate(p, leader_names, configs, histories, seed, blocksize) for p in paths]
+	else:
+		with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+			results = list(pool.map(accumulate, paths, *([x] * len(paths) for x in [leader_names, configs, histories, seed, blocksize])))
+
+	S, H = square.Histograms(leader_names, configs, seed=seed), [history.Histogram(binwidth=binwidth, minsize=minsize) for binwidth, minsize in histories]
+	for S_, H_ in results:
+		S.merge(S_)
+		for h, h_ in zip(H, H_):
+			h.merge(h_)
+	return S.results(), [h.result() for h in H]
+
+if __name__ == '__main__':
+	import os
+	import argparse
+	import matplotlib
+	matplotlib.use('Agg')
+	import matplotlib.pyplot as plt
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('data', nargs='+', metavar='DATA', help='Data files to pool (TSV, gzipped if they end with .gz)')
+	parser.add_argument('--bin-width', default=0.25, type=float, help='Bin width in percentage points')
+	parser.add_argument('--weights', default='voters', choices={'voters', 'given', 'leader', 'ones'}, help="'ones' (counts polling stations), 'voters' (counts registered voters), 'given' (counts ballots given), or 'leader' (counts ballots for the leader)")
+	parser.add_argument('--min-size', default=0, type=int, help='Minimum precinct size to include')
+	parser.add_argument('--noise', action='store_true', help='Add U(-0.5,0.5) noise to the numerators (to remove division artifacts)')
+	parser.add_argument('--square', metavar='FILE', help='Write the square figure to FILE')
+	parser.add_argument('--turnout', metavar='FILE', help='Write the turnout figure to FILE')
+	parser.add_argument('--history', metavar='FILE', help='Write the history figure to FILE')
+	parser.add_argument('--block-size', default=1 << 24, type=int, help='Bytes of the TSV to read at a time')
+	parser.add_argument('-j', '--jobs', default=1, type=int, help='Number of files to read in parallel')
+	parser.add_argument('--profile', metavar='FILE', help='Write a Chrome trace of the stages to FILE (or set ELECTION_DATA_PROFILE)')
+	args = parser.parse_args()
+	spans.enable(args.profile)
+
+	configs = [(args.bin_width, args.weights, args.min_size, args.noise)] if args.square or args.turnout else []
+	histories = [(args.bin_width, args.min_size)] if args.history else []
+	S, H = histograms(args.data, election_data.RU_LEADER, configs, histories, blocksize=args.block_size, jobs=args.jobs)
+	title = ' + '.join(os.path.basename(p) for p in args.data)
+
+	for output, figsize, draw in [(args.square, (9, 9), lambda: square.draw(*S[0], title=title, binwidth=args.bin_width)),
+	                              (args.turnout, (6, 2), lambda: turnout.draw(*S[0], title=title, binwidth=args.bin_width)),
+	                              (args.history, (12, 4), lambda: history.draw(*H[0], title=title))]:
+		if output:
+			plt.figure(figsize=figsize)
+			draw()
+			with spans.span('savefig'):
+				plt.savefig(output, bbox_inches='tight')
+			plt.close()
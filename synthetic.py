@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+# python3 synthetic.py RU_synthetic.tsv.gz --precincts 100000
+#
+# A made-up election in the exact TSV schema of ru_election_data.py, for benchmarking offline. Region sizes are
+# skewed like the real ones (a few regions with thousands of precincts, many with a few hundred), territories
+# hold about 35 precincts each, a share of precincts report inflated turnout together with a higher result
+# for the leader, and the turnout_HHhMM columns grow towards the final turnout through the day.
+
+import gzip
+import json
+import os
+
+import numpy as np
+
+import election_data
+
+CANDIDATES = ['Бабурин Сергей Николаевич', 'Грудинин Павел Николаевич', 'Жириновский Владимир Вольфович', 'Путин Владимир Владимирович',
+              'Собчак Ксения Анатольевна', 'Сурайкин Максим Александрович', 'Титов Борис Юрьевич', 'Явлинский Григорий Алексеевич']
+STREETS = ['Ленина', 'Мира', 'Советская', 'Школьная', 'Садовая', 'Центральная', 'Молодежная', 'Лесная', 'Новая', 'Набережная']
+
+def columns(glossary, candidates):
+	# the column order ru_election_data.py writes
+	return (['region_code', 'region_name', 'foreign', 'oik_num', 'district', 'tik_num', 'territory', 'precinct', 'electoral_id',
+	         'commission_address', 'commission_lat', 'commission_lon', 'station_address', 'station_lat', 'station_lon', 'voters_voted'] +
+	        list(glossary['fields']) + list(glossary['turnouts']) +
+	        [f'candidate{i}_name' for i in range(len(candidates))] + [f'candidate{i}_ballots' for i in range(len(candidates))])
+
+def generate(path, precincts=100000, seed=0, date='2018-03-18', name='president', anomalous=0.15, glossary=None):
+	glossary = glossary or json.load(open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ru_election_data.json')))
+	rng = np.random.default_rng(seed)
+	codes = list(glossary['regions'])
+	n = precincts
+
+	region = np.sort(rng.choice(len(codes), size=n, p=(lambda w: w / w.sum())(rng.lognormal(0, 0.8, len(codes)))))
+	start = np.searchsorted(region, np.arange(len(codes)))
+	within = np.arange(n) - start[region]
+	territory = within // rng.integers(20, 50, len(codes))[region]
+	precinct = within + rng.integers(1, 500, len(codes))[region] * 10
+
+	registered = np.clip(rng.lognormal(7.1, 0.7, n), 5, 3500).astype(np.int64)
+	anomaly = rng.random(n) < anomalous * rng.random(len(codes))[region] * 2
+	turnout = np.where(anomaly, rng.beta(18, 1.5, n), rng.beta(12, 7, n) * (0.8 + 0.4 * rng.random(len(codes))[region]).clip(0, 1 / 0.95))
+	voted = np.minimum(rng.binomial(registered, np.clip(turnout, 0, 1)), registered)
+	early = rng.binomial(voted, 0.002)
+	outside = rng.binomial(voted - early, 0.06)
+	at_station = voted - early - outside
+	invalid = rng.binomial(voted, 0.01)
+	valid = voted - invalid
+
+	shares = rng.dirichlet([2, 12, 6, 70, 2, 1, 1, 1.5], n)
+	shares[anomaly] = rng.dirichlet([1, 4, 2, 90, 1, 0.5, 0.5, 0.5], np.count_nonzero(anomaly))
+	ballots = rng.multinomial(valid, shares)
+
+	# a fraction of the final turnout reported at each time of the day, never decreasing
+	times = list(glossary['turnouts'])
+	progress = np.sort(rng.beta(np.arange(1, len(times) + 1) * 2, (len(times) + 1 - np.arange(1, len(times) + 1)) * 2, (n, len(times))), axis=1)
+	history = np.round(progress * (voted / np.maximum(registered, 1))[:, None], 4)
+	history[rng.random((n, len(times))) < 0.01] = np.nan
+
+	lat = (45 + 20 * rng.random(len(codes)))[region] + rng.normal(0, 0.5, n)
+	lon = (30 + 100 * rng.random(len(codes)))[region] + rng.normal(0, 1, n)
+	street = rng.integers(0, len(STREETS), n)
+	house = rng.integers(1, 200, n)
+
+	region_codes = np.array(codes)[region]
+	cols = {
+		'region_code': region_codes,
+		'region_name': np.array([glossary['regions'][c][0] for c in codes])[region],
+		'foreign': np.char.endswith(region_codes, '-FRN').astype(int),
+		'oik_num': np.full(n, -1),
+		'district': np.full(n, ''),
+		'tik_num': territory,
+		'territory': lambda s: [f'ТИК №{t} {STREETS[t % len(STREETS)]}ского района' for t in territory[s].tolist()],
+		'precinct': precinct,
+		'electoral_id': lambda s: election_data.ELECTORAL_ID.encode(region_codes[s], date, name, territory=territory[s], station=precinct[s]).tolist(),
+		'commission_address': lambda s: [f'ул. {STREETS[a]}, д. {h}' for a, h in zip(street[s].tolist(), house[s].tolist())],
+		'commission_lat': lat, 'commission_lon': lon,
+		'station_address': lambda s: [f'ул. {STREETS[a]}, д. {h}' for a, h in zip(street[s].tolist(), house[s].tolist())],
+		'station_lat': np.where(rng.random(n) < 0.3, np.nan, lat), 'station_lon': np.where(rng.random(n) < 0.3, np.nan, lon),
+		'voters_voted': voted,
+		'voters_registered': registered, 'voters_voted_at_station': at_station, 'voters_voted_outside_station': outside,
+		'voters_voted_early': early, 'ballots_valid': valid, 'ballots_invalid': invalid,
+	}
+	cols.update((t, history[:, i]) for i, t in enumerate(times))
+	cols.update((f'candidate{i}_name', np.full(n, c)) for i, c in enumerate(CANDIDATES))
+	cols.update((f'candidate{i}_ballots', ballots[:, i]) for i in range(len(CANDIDATES)))
+
+	formats = {k: '.6f' for k in ['commission_lat', 'commission_lon', 'station_lat', 'station_lon']}
+	formats.update((t, '.4f') for t in times)
+	fields = columns(glossary, CANDIDATES)
+	def text(k, s):
+		return cols[k](s) if callable(cols[k]) else [format(v, formats[k]) for v in cols[k][s].tolist()] if k in formats else list(map(str, cols[k][s].tolist()))
+
+	# written a block of rows at a time, only the numbers are held for the whole dataset
+	with (gzip.open if path.endswith('.gz') else open)(path, 'wt', encoding='utf-8', newline='\r\n') as out:
+		out.write('\t'.join(fields) + '\n')
+		for lo in range(0, n, 1 << 16):
+			s = slice(lo, lo + (1 << 16))
+			out.write(''.join('\t'.join(row) + '\n' for row in zip(*(text(k, s) for k in fields))))
+
+if __name__ == '__main__':
+	import argparse
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('output', metavar='OUTPUT', help='TSV file to write (gzipped if it ends with .gz)')
+	parser.add_argument('--precincts', default=100000, type=int, help='Number of precincts')
+	parser.add_argument('--seed', default=0, type=int, help='Random seed')
+	parser.add_argument('--anomalous', default=0.15, type=float, help='Average share of precincts with inflated turnout')
+	args = parser.parse_args()
+
+	generate(args.output, precincts=args.precincts, seed=args.seed, anomalous=args.anomalous)
@@ -0,0 +1,18 @@
+import os
+import sys
+
+# the modules live at the top of the repository; no parse cache or download mirror outside the test's own directories
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['ELECTION_DATA_CACHE'] = ''
+os.environ['ELECTION_DATA_MIRROR'] = ''
+
+import pytest
+
+import synthetic
+
+@pytest.fixture(scope='session')
+def tsv(tmp_path_factory):
+	# a small synthetic election in the schema of ru_election_data.py
+	path = str(tmp_path_factory.mktemp('data') / 'synthetic.tsv')
+	synthetic.generate(path, precincts=3000, seed=1)
+	return path
@@ -0,0 +1,13 @@
+import numpy as np
+
+import election_data
+
+def test_cache_miss_and_hit_are_read_only(tsv, tmp_path, monkeypatch):
+	monkeypatch.setattr(election_data, 'CACHE_DIR', str(tmp_path))
+	expected = election_data.load(tsv, cache=False)
+	for D in [election_data.load(tsv), election_data.load(tsv)]:
+		assert isinstance(D.base, np.memmap) and not D.flags.writeable
+		assert D.dtype == expected.dtype and D.categories.keys() == expected.categories.keys()
+		for n in D.dtype.names:
+			assert np.array_equal(election_data.codes(D, n), election_data.codes(expected, n), equal_nan=D.dtype[n].kind == 'f'), n
+	assert len(list(tmp_path.glob('*.npy'))) == 1
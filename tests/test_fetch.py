@@ -0,0 +1,106 @@
+import hashlib
+import http.server
+import os
+import tempfile
+import threading
+
+import pytest
+
+import fetch
+
+PAYLOAD = bytes(range(256)) * 4096
+ETAG = '"v1"'
+
+class Handler(http.server.BaseHTTPRequestHandler):
+	# PAYLOAD with an ETag, conditional GETs and If-Range requests; the requests are logged on the server and the
+	# first response can be cut off halfway
+	def do_GET(self):
+		self.server.requests.append(dict(self.headers))
+		if self.headers.get('If-None-Match') == ETAG:
+			self.send_response(304)
+			self.end_headers()
+			return
+		start = 0
+		if self.headers.get('Range') and self.headers.get('If-Range') == ETAG:
+			start = int(self.headers['Range'][len('bytes='):].rstrip('-'))
+			self.send_response(206)
+			self.send_header('Content-Range', f'bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}')
+		else:
+			self.send_response(200)
+		self.send_header('ETag', ETAG)
+		self.send_header('Content-Length', str(len(PAYLOAD) - start))
+		self.end_headers()
+		if self.server.drop:
+			self.server.drop = False
+			self.wfile.write(PAYLOAD[start:(start + len(PAYLOAD)) // 2])
+			return
+		self.wfile.write(PAYLOAD[start:])
+
+	def log_message(self, *args):
+		pass
+
+@pytest.fixture
+def server():
+	server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+	server.requests, server.drop = [], False
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	server.url = f'http://127.0.0.1:{server.server_address[1]}/data/file.tsv.gz'
+	yield server
+	server.shutdown()
+	server.server_close()
+
+def read(path):
+	with open(path, 'rb') as file:
+		return file.read()
+
+def test_fetch_and_refetch(server, tmp_path):
+	mirror = str(tmp_path)
+	path = fetch.fetch(server.url, mirror=mirror)
+	assert path == fetch.mirror_path(server.url, mirror) and read(path) == PAYLOAD
+	assert fetch.readmeta(path) == dict(etag=ETAG, last_modified=None, url=server.url, size=len(PAYLOAD), sha256=hashlib.sha256(PAYLOAD).hexdigest())
+	assert not os.path.exists(path + '.part') and not os.path.exists(path + '.part.json')
+
+	# the second fetch revalidates the copy and gets a 304
+	assert fetch.fetch(server.url, mirror=mirror, sha256=hashlib.sha256(PAYLOAD).hexdigest()) == path
+	assert server.requests[-1].get('If-None-Match') == ETAG and len(server.requests) == 2
+	assert read(path) == PAYLOAD
+
+def test_resume_truncated_part(server, tmp_path):
+	mirror = str(tmp_path)
+	path = fetch.mirror_path(server.url, mirror)
+	with open(path + '.part', 'wb') as file:
+		file.write(PAYLOAD[:100000])
+	fetch.writemeta(path + '.part', dict(etag=ETAG, last_modified=None))
+
+	assert fetch.fetch(server.url, mirror=mirror, sha256=hashlib.sha256(PAYLOAD).hexdigest()) == path
+	assert server.requests[0].get('Range') == 'bytes=100000-' and server.requests[0].get('If-Range') == ETAG
+	assert read(path) == PAYLOAD and not os.path.exists(path + '.part')
+
+def test_resume_dropped_connection(server, tmp_path):
+	server.drop = True
+	path = fetch.fetch(server.url, mirror=str(tmp_path), timeout=5)
+	assert read(path) == PAYLOAD
+	assert [r.get('Range') for r in server.requests] == [None, f'bytes={len(PAYLOAD) // 2}-']
+
+def test_sha256_mismatch(server, tmp_path):
+	wrong = hashlib.sha256(b'').hexdigest()
+	# without a mirror, the temporary copy is removed
+	copies = lambda: {name for name in os.listdir(tempfile.gettempdir()) if name.endswith('-file.tsv.gz')}
+	before = copies()
+	with pytest.raises(ValueError):
+		fetch.fetch(server.url, mirror='', sha256=wrong)
+	assert copies() <= before
+
+	# a download into the mirror leaves nothing behind
+	mirror = str(tmp_path)
+	path = fetch.mirror_path(server.url, mirror)
+	with pytest.raises(ValueError):
+		fetch.fetch(server.url, mirror=mirror, sha256=wrong)
+	assert os.listdir(mirror) == []
+
+	# a mirrored copy is checked against its recorded sha256
+	fetch.fetch(server.url, mirror=mirror)
+	with pytest.raises(ValueError):
+		fetch.fetch(server.url, mirror=mirror, sha256=wrong)
+	assert read(path) == PAYLOAD
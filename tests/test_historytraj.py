@@ -0,0 +1,17 @@
+import warnings
+
+import numpy as np
+
+import historytraj
+
+def test_rasterize_repeated_time():
+	# the same turnout reported twice at 14:00 gives the same polylines as reported once
+	rng = np.random.default_rng(1)
+	y = rng.random((50, 4)) * 100
+	y[:, 2] = y[:, 1]
+	weights = rng.random(50)
+	expected = historytraj.rasterize(np.array([8., 14., 20.]), y[:, [0, 1, 3]], weights, (7, 21), (0, 105), (56, 42))
+	with warnings.catch_warnings():
+		warnings.simplefilter('error')
+		grid = historytraj.rasterize(np.array([8., 14., 14., 20.]), y, weights, (7, 21), (0, 105), (56, 42))
+	assert np.array_equal(grid, expected) and grid.sum() > 0
@@ -0,0 +1,11 @@
+import numpy as np
+
+import montecarlo
+
+def test_binomial_leaves_out_precincts_without_voters():
+	# a precinct with no registered voters passes the filter of square.histograms but its turnout is nan, so it is
+	# in no turnout bin; the binomial replicates must not put it at 0 %
+	voted, registered, leader, valid = (np.array(a, dtype=np.int64) for a in [[0, 50], [0, 100], [0, 10], [1, 20]])
+	HT, HR, C = montecarlo.replicates(np.random.default_rng(1), 16, voted, registered, leader, valid, binwidth=1, weights='ones', mode='binomial', batch=4)
+	assert np.all(HT[:, 0] == 0) and np.all(HT.sum(axis=1) == 1)
+	assert np.all(HR[:, 0] == 1) and np.all(HR.sum(axis=1) == 2)
@@ -0,0 +1,33 @@
+import itertools
+
+import numpy as np
+
+import election_data
+import square
+
+def reference(D, leader_names, *, binwidth, weights, minsize, noise, seed=1):
+	# one histogram the way square.histogram computed it before histograms() batched them: np.histogram2d with
+	# the turnout noise and then the result noise drawn from one RandomState
+	rnd = np.random.RandomState(seed)
+	edges = np.arange(-binwidth/2, 100 + binwidth/2, binwidth)
+	D = election_data.filter(D, ballots_valid_invalid_min=1, voters_registered_min=minsize, voters_voted_le_voters_registered=True, foreign=False)
+	leader = election_data.find_leader_score(D, leader_names)
+	wval = {'voters': D.voters_registered, 'given': D.voters_voted, 'leader': leader, 'ones': np.ones(len(D))}[weights]
+	noise1 = np.zeros(len(D)) if not noise else rnd.rand(len(D)) - .5
+	noise2 = np.zeros(len(D)) if not noise else rnd.rand(len(D)) - .5
+	return np.histogram2d(100 * (D.voters_voted + noise1) / D.voters_registered, 100 * (leader + noise2) / D.ballots_valid_invalid, bins=edges, weights=wval)[0]
+
+def test_histograms_match_histogram(tsv):
+	D = election_data.load(tsv, cache=False)
+	configs = list(itertools.product([0.1, 0.25, 1], square.WEIGHTS, [0, 100, 1000], [False, True]))
+	for data in [D, election_data.Index(D)]:
+		batched = square.histograms(data, election_data.RU_LEADER, configs)
+		assert len(batched) == len(configs)
+		for (binwidth, weights, minsize, noise), (wlbl, centers, h, ht, hr) in zip(configs, batched):
+			single = square.histogram(data, election_data.RU_LEADER, binwidth=binwidth, weights=weights, minsize=minsize, noise=noise)
+			expected = reference(D, election_data.RU_LEADER, binwidth=binwidth, weights=weights, minsize=minsize, noise=noise)
+			assert wlbl == single[0] == square.WEIGHTS[weights]
+			assert np.array_equal(centers, single[1])
+			assert np.array_equal(h, single[2]) and np.array_equal(h, expected), (binwidth, weights, minsize, noise)
+			assert np.array_equal(ht, h.sum(axis=1)) and np.array_equal(hr, h.sum(axis=0))
+			assert h.sum() > 0
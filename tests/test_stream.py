@@ -0,0 +1,30 @@
+import numpy as np
+
+import election_data
+import history
+import square
+import stream
+
+CONFIGS = [(0.25, 'voters', 0, False), (0.5, 'ones', 100, True), (1, 'leader', 0, True)]
+
+def test_chunks_without_binned_rows(tsv, tmp_path):
+	# the last 400 precincts are foreign, so with small blocks the last chunks have no row to bin
+	with open(tsv, encoding='utf-8', newline='') as file:
+		lines = file.readlines()
+	header = lines[0].rstrip('\r\n').split('\t')
+	foreign = header.index('foreign')
+	tail = [line.split('\t') for line in lines[-400:]]
+	for row in tail:
+		row[foreign] = '1'
+	path = str(tmp_path / 'foreign_tail.tsv')
+	with open(path, 'w', encoding='utf-8', newline='') as file:
+		file.writelines(lines[:-400] + ['\t'.join(row) for row in tail])
+
+	D = election_data.load(path, cache=False)
+	expected = square.histograms(D, election_data.RU_LEADER, CONFIGS)
+	H = history.histogram(D)
+	for blocksize in [1 << 24, 20000]:
+		S, [h] = stream.histograms([path], election_data.RU_LEADER, CONFIGS, histories=[(0.25, 0)], blocksize=blocksize)
+		for a, b in zip(S, expected):
+			assert np.array_equal(a[2], b[2])
+		assert h[1].keys() == H[1].keys() and all(np.array_equal(h[1][n], H[1][n]) for n in H[1])
@@ -4,11 +4,13 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 import election_data
+import spans
 import square
 
-def plot(D, leader_names, title, binwidth=0.25, aspect = 3, spacing = 0.2, **kwargs):
-	wlbl, centers, h = square.histogram(D, leader_names, binwidth=binwidth, **kwargs)
-	ht = np.sum(h, axis=1)
+def plot(D, leader_names, title, binwidth=0.25, aspect = 3, spacing = 0.2, weights='voters', minsize=0, noise=False, seed=1):
+	draw(*square.histograms(D, leader_names, [(binwidth, weights, minsize, noise)], seed=seed)[0], title=title, binwidth=binwidth)
+
+def draw(wlbl, centers, h, ht, hr, title, binwidth=0.25):
 	ylog = int(np.ceil(np.log10(np.max(ht)))) - 1
 
 	plt.suptitle(title, size=20, y=0.925, va='baseline')
@@ -33,11 +35,14 @@ if __name__ == '__main__':
 	parser.add_argument('--min-size', default=0, type=int, help='Minimum precinct size to include')
 	parser.add_argument('--noise', action='store_true', help='Add U(-0.5,0.5) noise to the numerators (to remove division artifacts)')
 	parser.add_argument('-o', '--output', default='turnout.png', help='Output file')
+	parser.add_argument('--profile', metavar='FILE', help='Write a Chrome trace of the stages to FILE (or set ELECTION_DATA_PROFILE)')
 	args = parser.parse_args()
+	spans.enable(args.profile)
 
 	D = election_data.load(args.data)
 
 	plt.figure(figsize = (6, 2))
 	plot(D, leader_names = election_data.RU_LEADER, title=os.path.basename(args.data), binwidth=args.bin_width, weights=args.weights, minsize=args.min_size, noise=args.noise)
-	plt.savefig(args.output, bbox_inches='tight')
+	with spans.span('savefig'):
+		plt.savefig(args.output, bbox_inches='tight')
 	plt.close()
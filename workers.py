@@ -0,0 +1,18 @@
+import concurrent.futures
+
+# Arrays sent once to every process of a pool, through its initializer, instead of with every task
+shared = None
+
+def attach(*arrays):
+	global shared
+	shared = arrays
+
+def call(work, task, kwargs):
+	return work(shared, *task, **kwargs)
+
+def run(work, arrays, tasks, jobs=1, **kwargs):
+	# work(arrays, *task, **kwargs) for every task, in a process pool if jobs > 1; the results in the order of tasks
+	if jobs == 1:
+		return [work(arrays, *task, **kwargs) for task in tasks]
+	with concurrent.futures.ProcessPoolExecutor(jobs, initializer=attach, initargs=arrays) as pool:
+		return [future.result() for future in [pool.submit(call, work, task, kwargs) for task in tasks]]